@@ -1,10 +1,31 @@
-import pandas as pd
+def load_pandas():
+    # pandas takes hundreds of milliseconds to import, so only pay for it when it's actually used,
+    # and fall back to plain lists of rows when it isn't installed
+    try:
+        import pandas
+        return pandas
+    except ImportError:
+        return None
 
 
 def get_most_common_bits(df):
+    if isinstance(df, list): # rows of ints, the no-pandas fallback
+        return [(1 if sum([row[i] for row in df]) / len(df) >= 0.5 else 0) for i in range(0,12)]
     return [(1 if df[i].mean() >= 0.5 else 0) for i in range(0,12)]
 
 
+def filter_rows(df, i, bit):
+    if isinstance(df, list):
+        return [row for row in df if row[i] == bit]
+    return df[df[i] == bit]
+
+
+def first_row(df):
+    if isinstance(df, list):
+        return df[0]
+    return df.iloc[0]
+
+
 def invert_bit_list(bit_list):
     return [(1 if bit == 0 else 0) for i, bit in enumerate(bit_list)]
 
@@ -12,7 +33,9 @@ def invert_bit_list(bit_list):
 if __name__ == "__main__":
     input03 = open("input03", encoding="utf-8").read().strip()
     input03lines = input03.split("\n")
-    bit_string_df = pd.DataFrame([[int(c) for c in x] for x in input03lines])
+    pd = load_pandas()
+    bit_rows = [[int(c) for c in x] for x in input03lines]
+    bit_string_df = pd.DataFrame(bit_rows) if pd is not None else bit_rows
 
     most_common_bits = get_most_common_bits(bit_string_df)
     least_common_bits = invert_bit_list(most_common_bits)
@@ -27,23 +50,23 @@ if __name__ == "__main__":
 
     ### part 2 ###
 
-    bit_string_length =  len(bit_string_df.loc[0, :])
+    bit_string_length = len(bit_rows[0])
 
     temp_bit_string_df = bit_string_df.copy()
     for i in range(0, bit_string_length):
         most_common_bits = get_most_common_bits(temp_bit_string_df)
-        temp_bit_string_df = temp_bit_string_df[temp_bit_string_df[i] == most_common_bits[i]]
+        temp_bit_string_df = filter_rows(temp_bit_string_df, i, most_common_bits[i])
         if len(temp_bit_string_df) == 1:
             break
-    oxygen_generator_rating = int("".join([str(i) for i in temp_bit_string_df.iloc[0]]), 2)
+    oxygen_generator_rating = int("".join([str(i) for i in first_row(temp_bit_string_df)]), 2)
 
     temp_bit_string_df = bit_string_df.copy()
     for i in range(0, bit_string_length):
         least_common_bits = invert_bit_list(get_most_common_bits(temp_bit_string_df))
-        temp_bit_string_df = temp_bit_string_df[temp_bit_string_df[i] == most_common_bits[i]]
+        temp_bit_string_df = filter_rows(temp_bit_string_df, i, most_common_bits[i])
         if len(temp_bit_string_df) == 1:
             break
-    co2_scrubber_rating = int("".join([str(i) for i in temp_bit_string_df.iloc[0]]), 2)
+    co2_scrubber_rating = int("".join([str(i) for i in first_row(temp_bit_string_df)]), 2)
 
     print(f"oxygen generator rating = {oxygen_generator_rating}") # 509
     print(f"co2 scrubber rating = {co2_scrubber_rating}") # 2693
@@ -1,4 +1,30 @@
-import networkx as nx
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from dataclasses import dataclass
+from hashlib import blake2b
+from heapq import heappush, heappop
+from array import array
+
+
+def load_networkx():
+    # networkx costs a few hundred milliseconds to import and is only needed for exporting graphs
+    # or the "networkx" engine, the native engines don't need it installed at all
+    import networkx
+    return networkx
+
+
+def load_numpy():
+    # numpy only speeds up building CSR graphs, the search engines run on plain arrays,
+    # so fall back to a per-cell loop when it isn't installed
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
 
 
 def grid_from_input_p1(input_string):
@@ -47,55 +73,645 @@ def node_name(x, y):
 
 
 def graph_from_grid(grid):
-    DG = nx.DiGraph()
+    return csr_from_grid(grid).to_networkx()
 
-    # this isn't strictly necessary because nodes are added implicitly when edges are added, 
-    # but it costs little and lets us keep the risk values associated with the node not just the edges
-    for y, row in enumerate(grid):
-        for x, cell in enumerate(row):
-            DG.add_node(f"({x},{y})", node_risk=cell)
 
-    x_size = len(grid[0])
-    y_size = len(grid)
-    for y, row in enumerate(grid):
-        for x, cell in enumerate(row):
-            # for each possible neighboring cell, if it exists, add an edge weighted by the risk of *that* cell
-            # also add a reverse edge weighted by the risk of *this* cell
-            for other_x, other_y in [
-                (x-1, y), # left
-                (x, y-1), # up
-                (x+1, y), # right
-                (x, y+1), # down
-            ]:
-                if 0 <= other_x < x_size and 0 <= other_y < y_size: # bounds check
-                    this_node = node_name(x, y)
-                    that_node = node_name(other_x, other_y)
-                    out_edge_weight = grid[other_y][other_x]
-                    in_edge_weight = grid[y][x]
-                    DG.add_weighted_edges_from([(this_node, that_node, out_edge_weight)], weight="edge_risk")
-                    DG.add_weighted_edges_from([(that_node, this_node, in_edge_weight)], weight="edge_risk")
-
-    return DG
+@dataclass
+class CsrGraph:
+    # compressed sparse row adjacency: node i's out-edges are targets[offsets[i]:offsets[i+1]],
+    # with matching entries in weights
+    offsets: array
+    targets: array
+    weights: array
+    width: int = None # only set for graphs built from a grid, used to name nodes on export
+    node_risks: list = None
+
+    @property
+    def node_count(self) -> int:
+        return len(self.offsets) - 1
+
+    def to_networkx(self):
+        # nodes are named like node_name for grid graphs so the result matches what graph_from_grid used to build
+        names = [node_name(i % self.width, i // self.width) if self.width else i for i in range(self.node_count)]
+
+        nx = load_networkx()
+        DG = nx.DiGraph()
+        for i, name in enumerate(names):
+            if self.node_risks is not None:
+                DG.add_node(name, node_risk=self.node_risks[i])
+            else:
+                DG.add_node(name)
+        DG.add_weighted_edges_from(
+            [
+                (names[i], names[self.targets[e]], self.weights[e])
+                for i in range(self.node_count)
+                for e in range(self.offsets[i], self.offsets[i+1])
+            ],
+            weight="edge_risk",
+        )
+        return DG
+
+
+def array_from_numpy(typecode, values) -> array:
+    # copies the raw buffer across at the array's own item size instead of going through a list of ints
+    result = array(typecode)
+    result.frombytes(values.astype(f"i{result.itemsize}").tobytes())
+    return result
+
+
+def csr_from_grid_loop(grid) -> CsrGraph:
+    # one pass over the cells, each directed edge written exactly once and weighted by the risk of the cell it enters
+    risks, width, height = flat_view(grid)
+    size = width * height
+    offsets = array("l", [0])
+    targets = array("l")
+    weights = array("b")
+    for i in range(size):
+        x = i % width
+        for j in (
+            i-1 if x > 0 else -1,          # left
+            i-width,                       # up
+            i+1 if x < width-1 else -1,    # right
+            i+width if i+width < size else -1, # down
+        ):
+            if j >= 0:
+                targets.append(j)
+                weights.append(risks[j])
+        offsets.append(len(targets))
+    return CsrGraph(offsets, targets, weights, width, risks)
+
+
+def csr_from_grid(grid) -> CsrGraph:
+    # built with whole-array operations: every cell gets its four candidate edges (left, up, right, down),
+    # the ones that would leave the grid are masked out, and each kept edge is weighted by the risk of the cell it enters
+    np = load_numpy()
+    if np is None:
+        return csr_from_grid_loop(grid)
+    risks, width, height = flat_view(grid)
+    size = width * height
+    if isinstance(grid, TiledGrid):
+        # expand the tiles straight from the base grid rather than reading the lazy grid cell by cell
+        # summed in int32, risk plus two tile offsets passes int8's 127 once tile_factor reaches the 60s
+        base = np.array(grid.base_risks, dtype=np.int32).reshape(grid.base_height, 1, grid.base_width)
+        tiles = np.arange(grid.tile_factor, dtype=np.int32)
+        dense = (base[None, :, :, :] + tiles[:, None, None, None] + tiles[None, None, :, None] - 1) % 9 + 1
+        dense = dense.astype(np.int8).reshape(size)
+    else:
+        dense = np.frombuffer(bytes(risks), dtype=np.int8)
+
+    cells = np.arange(size)
+    x = cells % width
+    candidates = np.stack([cells-1, cells-width, cells+1, cells+width], axis=1)
+    kept = np.stack([x > 0, cells >= width, x < width-1, cells+width < size], axis=1)
+
+    targets = candidates[kept] # row-major, so each cell's edges stay together and in order
+    offsets = np.zeros(size+1, dtype=np.int64)
+    np.cumsum(kept.sum(axis=1), out=offsets[1:])
+    return CsrGraph(
+        array_from_numpy("l", offsets),
+        array_from_numpy("l", targets),
+        array_from_numpy("b", dense[targets]),
+        width,
+        risks, # tiled grids stay lazy, indexed only if the graph is exported
+    )
+
+
+UNREACHED = 2**62 # stands in for infinity in the int64 distance arrays
+
+
+def dijkstra_csr(graph: CsrGraph, start=0, finish=None, stats=None) -> int:
+    # same as dijkstra_flat but for any topology, with the edge weights taken from the graph
+    if finish is None:
+        finish = graph.node_count - 1
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+
+    distances = array("q", [UNREACHED]) * graph.node_count
+    distances[start] = 0
+    heap = [(0, start)]
+    expanded = 0
+    result = None
+    while heap:
+        distance, i = heappop(heap)
+        if distance > distances[i]:
+            continue # stale entry, a shorter route was already expanded
+        expanded += 1
+        if i == finish:
+            result = distance
+            break
+
+        for e in range(offsets[i], offsets[i+1]):
+            j = targets[e]
+            new_distance = distance + weights[e]
+            if new_distance < distances[j]:
+                distances[j] = new_distance
+                heappush(heap, (new_distance, j))
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return result
+
+
+class TiledGrid:
+    # the part 2 expansion of a base grid, computed cell by cell on demand instead of materialised;
+    # indexing by flat cell index makes it usable anywhere the engines take a flat risks list
+    def __init__(self, base_grid, tile_factor=5):
+        self.base_risks, self.base_width, self.base_height = flatten_grid(base_grid)
+        self.tile_factor = tile_factor
+        self.width = self.base_width * tile_factor
+        self.height = self.base_height * tile_factor
+
+    @property
+    def min_risk(self) -> int:
+        # tile offsets run 0..2*(tile_factor-1), and wrapping around 9 only repeats after 9 steps
+        offsets = range(min(9, 2*self.tile_factor-1))
+        return min([wrap_1_to_9(r + offset) for r in set(self.base_risks) for offset in offsets])
+
+    def risk(self, x, y) -> int:
+        tile_x, base_x = divmod(x, self.base_width)
+        tile_y, base_y = divmod(y, self.base_height)
+        return wrap_1_to_9(self.base_risks[base_y*self.base_width + base_x] + tile_y + tile_x)
+
+    def __getitem__(self, i) -> int:
+        y, x = divmod(i, self.width)
+        tile_x, base_x = divmod(x, self.base_width)
+        tile_y, base_y = divmod(y, self.base_height)
+        return (self.base_risks[base_y*self.base_width + base_x] + tile_y + tile_x - 1) % 9 + 1 # wrap_1_to_9, inlined
+
+    def __len__(self) -> int:
+        return self.width * self.height
+
+
+def grid_from_input_tiled(input_string, tile_factor=5) -> TiledGrid:
+    return TiledGrid(grid_from_input_p1(input_string), tile_factor)
+
+
+def flat_view(grid) -> (list[int], int, int): # (risks, width, height)
+    if isinstance(grid, TiledGrid):
+        return grid, grid.width, grid.height
+    return flatten_grid(grid)
+
+
+def flatten_grid(grid) -> (list[int], int, int): # (risks, width, height)
+    # row-major, so cell (x, y) lives at index y*width + x
+    width = len(grid[0])
+    height = len(grid)
+    risks = [cell for row in grid for cell in row]
+    return risks, width, height
+
+
+def dijkstra_flat(risks, width, height, start=0, finish=None, stats=None) -> int:
+    # risks is any sequence indexed by flat cell index, entering a cell costs its risk
+    # pass a dict as stats to get the number of nodes expanded back in stats["expanded"]
+    size = width * height
+    if finish is None:
+        finish = size - 1
+
+    distances = array("q", [UNREACHED]) * size
+    distances[start] = 0
+    heap = [(0, start)]
+    expanded = 0
+    result = None
+    while heap:
+        distance, i = heappop(heap)
+        if distance > distances[i]:
+            continue # stale entry, a shorter route was already expanded
+        expanded += 1
+        if i == finish:
+            result = distance
+            break
+
+        x = i % width
+        for j in (
+            i-1 if x > 0 else -1,          # left
+            i-width,                       # up
+            i+1 if x < width-1 else -1,    # right
+            i+width if i+width < size else -1, # down
+        ):
+            if j < 0:
+                continue
+            new_distance = distance + risks[j]
+            if new_distance < distances[j]:
+                distances[j] = new_distance
+                heappush(heap, (new_distance, j))
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return result
+
+
+def dial_flat(risks, width, height, start=0, finish=None, max_risk=9, stats=None) -> int:
+    # Dial's algorithm: with risks in 1..max_risk every tentative distance is within max_risk of the one being expanded,
+    # so a ring of max_risk+1 buckets indexed by distance % (max_risk+1) replaces the heap
+    size = width * height
+    if finish is None:
+        finish = size - 1
+
+    ring_size = max_risk + 1
+    buckets = [[] for _ in range(ring_size)]
+    distances = array("q", [UNREACHED]) * size
+    distances[start] = 0
+    buckets[0].append(start)
+    pending = 1
+    expanded = 0
+    result = None
+
+    distance = 0
+    while pending and result is None:
+        bucket = buckets[distance % ring_size]
+        while bucket:
+            i = bucket.pop()
+            pending -= 1
+            if distances[i] != distance:
+                continue # stale entry, a shorter route was already found
+            expanded += 1
+            if i == finish:
+                result = distance
+                break
+
+            x = i % width
+            for j in (
+                i-1 if x > 0 else -1,          # left
+                i-width,                       # up
+                i+1 if x < width-1 else -1,    # right
+                i+width if i+width < size else -1, # down
+            ):
+                if j < 0:
+                    continue
+                new_distance = distance + risks[j]
+                if new_distance < distances[j]:
+                    distances[j] = new_distance
+                    buckets[new_distance % ring_size].append(j)
+                    pending += 1
+        distance += 1
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return result
+
+
+def min_risk(risks) -> int:
+    if isinstance(risks, TiledGrid):
+        return risks.min_risk
+    return min(risks)
+
+
+def astar_flat(risks, width, height, start=0, finish=None, stats=None) -> int:
+    # every step costs at least the smallest risk on the grid, so Manhattan distance to the finish times that
+    # never overestimates, and it changes by at most one step's cost per move so nodes never need re-expanding
+    size = width * height
+    if finish is None:
+        finish = size - 1
+    finish_y, finish_x = divmod(finish, width)
+    step_cost = min_risk(risks)
+
+    def heuristic(i):
+        y, x = divmod(i, width)
+        return (abs(finish_x-x) + abs(finish_y-y)) * step_cost
+
+    distances = array("q", [UNREACHED]) * size
+    distances[start] = 0
+    heap = [(heuristic(start), 0, start)]
+    expanded = 0
+    result = None
+    while heap:
+        _, distance, i = heappop(heap)
+        if distance > distances[i]:
+            continue # stale entry, a shorter route was already expanded
+        expanded += 1
+        if i == finish:
+            result = distance
+            break
+
+        x = i % width
+        for j in (
+            i-1 if x > 0 else -1,          # left
+            i-width,                       # up
+            i+1 if x < width-1 else -1,    # right
+            i+width if i+width < size else -1, # down
+        ):
+            if j < 0:
+                continue
+            new_distance = distance + risks[j]
+            if new_distance < distances[j]:
+                distances[j] = new_distance
+                heappush(heap, (new_distance + heuristic(j), new_distance, j))
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return result
+
+
+def bidirectional_flat(risks, width, height, start=0, finish=None, stats=None) -> int:
+    # Dijkstra from both ends, always growing the smaller frontier
+    # going forward an i->j step costs risks[j]; going backward from j to i it's the risk of the cell being left, risks[j] again
+    size = width * height
+    if finish is None:
+        finish = size - 1
+
+    distances = [array("q", [UNREACHED]) * size, array("q", [UNREACHED]) * size] # [forward, backward]
+    distances[0][start] = 0
+    distances[1][finish] = 0
+    heaps = [[(0, start)], [(0, finish)]]
+    best = 0 if start == finish else UNREACHED
+    expanded = 0
+
+    while heaps[0] and heaps[1]:
+        # no undiscovered route can beat best once the two frontiers together are at least that long
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+
+        side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        heap, own, other = heaps[side], distances[side], distances[1-side]
+        distance, i = heappop(heap)
+        if distance > own[i]:
+            continue # stale entry, a shorter route was already expanded
+        expanded += 1
+
+        x = i % width
+        for j in (
+            i-1 if x > 0 else -1,          # left
+            i-width,                       # up
+            i+1 if x < width-1 else -1,    # right
+            i+width if i+width < size else -1, # down
+        ):
+            if j < 0:
+                continue
+            new_distance = distance + (risks[j] if side == 0 else risks[i])
+            if new_distance < own[j]:
+                own[j] = new_distance
+                heappush(heap, (new_distance, j))
+            if other[j] != UNREACHED:
+                best = min(best, new_distance + other[j])
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return best if best != UNREACHED else None
+
+
+@dataclass
+class DistanceMap:
+    # least total risk from start to every cell, plus the previous cell on one such path (-1 for start)
+    width: int
+    height: int
+    start: int
+    distances: array
+    predecessors: array
+
+    def distance_to(self, x, y) -> int:
+        distance = self.distances[y*self.width + x]
+        return distance if distance != UNREACHED else None
+
+    def path_to(self, x, y) -> list[tuple[int, int]]: # [(x, y)] from start to (x, y) inclusive
+        i = y*self.width + x
+        if self.distances[i] == UNREACHED:
+            return None
+        path = []
+        while i != -1:
+            path.append((i % self.width, i // self.width))
+            i = self.predecessors[i]
+        path.reverse()
+        return path
+
+
+def distance_map_flat(risks, width, height, start=0) -> DistanceMap:
+    # dijkstra_flat without the early exit, remembering where each best distance came from
+    size = width * height
+    distances = array("q", [UNREACHED]) * size
+    predecessors = array("l", [-1]) * size
+    distances[start] = 0
+    heap = [(0, start)]
+    while heap:
+        distance, i = heappop(heap)
+        if distance > distances[i]:
+            continue # stale entry, a shorter route was already expanded
+
+        x = i % width
+        for j in (
+            i-1 if x > 0 else -1,          # left
+            i-width,                       # up
+            i+1 if x < width-1 else -1,    # right
+            i+width if i+width < size else -1, # down
+        ):
+            if j < 0:
+                continue
+            new_distance = distance + risks[j]
+            if new_distance < distances[j]:
+                distances[j] = new_distance
+                predecessors[j] = i
+                heappush(heap, (new_distance, j))
+
+    return DistanceMap(width, height, start, distances, predecessors)
+
+
+def grid_hash(grid) -> bytes:
+    # tiled grids are identified by their base and tile factor so hashing never expands them
+    if isinstance(grid, TiledGrid):
+        content = bytes(grid.base_risks) + f"|{grid.base_width}x{grid.base_height}*{grid.tile_factor}".encode()
+    else:
+        risks, width, height = flatten_grid(grid)
+        content = bytes(risks) + f"|{width}x{height}".encode()
+    return blake2b(content, digest_size=16).digest()
+
+
+class DistanceMapCache:
+    # distance maps per grid, keyed by grid hash and then start, evicting the least recently used grid
+    # (with all of its starts) once there are more than max_grids
+    # grids seen before are recognised by identity, so only a grid object the cache hasn't met yet gets hashed
+    # (grids are treated as read-only once queried, as everywhere else here)
+    def __init__(self, max_grids=8):
+        self.max_grids = max_grids
+        self.maps = OrderedDict() # grid hash -> {start: DistanceMap}
+        self.grid_keys = {} # id(grid) -> (grid, hash), holding the grid so its id can't be reused
+        self.hits = 0
+        self.misses = 0
+
+    def grid_key(self, grid) -> bytes:
+        entry = self.grid_keys.get(id(grid))
+        if entry is not None and entry[0] is grid:
+            return entry[1]
+        digest = grid_hash(grid)
+        self.grid_keys[id(grid)] = (grid, digest)
+        return digest
+
+    def get(self, grid, start=(0, 0)) -> DistanceMap:
+        key = self.grid_key(grid)
+        grid_maps = self.maps.get(key)
+        if grid_maps is None:
+            grid_maps = self.maps[key] = {}
+            if len(self.maps) > self.max_grids:
+                evicted_hash, _ = self.maps.popitem(last=False)
+                self.grid_keys = {k: v for k, v in self.grid_keys.items() if v[1] != evicted_hash}
+        else:
+            self.maps.move_to_end(key)
+
+        if start in grid_maps:
+            self.hits += 1
+            return grid_maps[start]
+
+        self.misses += 1
+        risks, width, height = flat_view(grid)
+        start_x, start_y = start
+        distance_map = distance_map_flat(risks, width, height, start_y*width + start_x)
+        grid_maps[start] = distance_map
+        return distance_map
+
+
+DISTANCE_MAP_CACHE = DistanceMapCache()
+
+
+def least_total_risk_to(grid, x, y, start=(0, 0)) -> int:
+    return DISTANCE_MAP_CACHE.get(grid, start).distance_to(x, y)
+
+
+def least_total_risk_dijkstra(grid) -> int:
+    risks, width, height = flat_view(grid)
+    return dijkstra_flat(risks, width, height)
+
+
+def least_total_risk_dial(grid) -> int:
+    risks, width, height = flat_view(grid)
+    return dial_flat(risks, width, height)
+
+
+def least_total_risk_astar(grid) -> int:
+    risks, width, height = flat_view(grid)
+    return astar_flat(risks, width, height)
+
+
+def least_total_risk_bidirectional(grid) -> int:
+    risks, width, height = flat_view(grid)
+    return bidirectional_flat(risks, width, height)
+
+
+def least_total_risk_csr(grid) -> int:
+    return dijkstra_csr(csr_from_grid(grid))
+
+
+def least_total_risk_networkx(grid) -> int:
+    graph = graph_from_grid(grid)
+    start_node = node_name(0, 0)
+    finish_node = node_name(len(grid[0])-1, len(grid)-1)
+    return load_networkx().shortest_path_length(graph, start_node, finish_node, "edge_risk")
+
+
+SHORTEST_PATH_ENGINES = {
+    "dijkstra": least_total_risk_dijkstra,
+    "dial": least_total_risk_dial,
+    "astar": least_total_risk_astar,
+    "bidirectional": least_total_risk_bidirectional,
+    "csr": least_total_risk_csr,
+    "networkx": least_total_risk_networkx,
+}
+
+
+def benchmark_engines(grid, engine_names) -> dict: # {engine name: (total risk, seconds)}
+    results = {}
+    for name in engine_names:
+        started = time.perf_counter()
+        total_risk = SHORTEST_PATH_ENGINES[name](grid)
+        results[name] = (total_risk, time.perf_counter() - started)
+    return results
+
+
+def _shared_risks_worker(shm_name, jobs) -> list[int]: # jobs [(offset, width, height, start, finish)] into the shared block
+    shm = SharedMemory(name=shm_name)
+    try:
+        results = []
+        for offset, width, height, start, finish in jobs:
+            with shm.buf[offset:offset + width*height] as risks:
+                results.append(dial_flat(risks, width, height, start, finish))
+        return results
+    finally:
+        shm.close()
+
+
+def _run_shared_jobs(content: bytes, jobs, workers=None) -> list[int]:
+    # risks go into one shared memory block that workers attach to by name, so only the small job tuples get pickled;
+    # jobs are dealt out round-robin and the results put back in job order
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    shm = SharedMemory(create=True, size=max(1, len(content)))
+    try:
+        shm.buf[:len(content)] = content
+        chunk_indexes = [list(range(n, len(jobs), workers)) for n in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = executor.map(
+                _shared_risks_worker,
+                [shm.name]*workers,
+                [[jobs[i] for i in indexes] for indexes in chunk_indexes],
+            )
+            results = [None] * len(jobs)
+            for indexes, chunk in zip(chunk_indexes, chunk_results):
+                for i, result in zip(indexes, chunk):
+                    results[i] = result
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def least_total_risk_batch(grids, workers=None) -> list[int]: # top-left to bottom-right for each grid
+    if not grids:
+        return []
+    content = bytearray()
+    jobs = []
+    for grid in grids:
+        risks, width, height = flat_view(grid)
+        jobs.append((len(content), width, height, 0, width*height - 1))
+        content += bytes(risks[i] for i in range(width*height))
+    return _run_shared_jobs(bytes(content), jobs, workers)
+
+
+def least_total_risk_pairs(grid, pairs, workers=None) -> list[int]: # pairs [((start_x, start_y), (finish_x, finish_y))]
+    if not pairs:
+        return []
+    risks, width, height = flat_view(grid)
+    content = bytes(risks[i] for i in range(width*height))
+    jobs = [(0, width, height, sy*width + sx, fy*width + fx) for (sx, sy), (fx, fy) in pairs]
+    return _run_shared_jobs(content, jobs, workers)
+
+
+FLAT_SEARCHES = {
+    "dijkstra": dijkstra_flat,
+    "dial": dial_flat,
+    "astar": astar_flat,
+    "bidirectional": bidirectional_flat,
+}
+
+
+def nodes_expanded_by_mode(grid) -> dict: # {search name: (total risk, nodes expanded)}
+    risks, width, height = flat_view(grid)
+    results = {}
+    for name, search in FLAT_SEARCHES.items():
+        stats = {}
+        total_risk = search(risks, width, height, stats=stats)
+        results[name] = (total_risk, stats["expanded"])
+    return results
 
 
 if __name__ == "__main__":
     input15 = open("input15", encoding="utf-8").read().strip()
 
+    # e.g. `python puzzle15nwx.py networkx` to compare against the original graph-based approach
+    engine_names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    engine = SHORTEST_PATH_ENGINES[engine_names[0] if engine_names else "dijkstra"]
+
     print("Part 1")
     grid_p1 = grid_from_input_p1(input15)
-    graph_p1 = graph_from_grid(grid_p1)
-    start_node_p1 = node_name(0, 0)
-    finish_node_p1 = node_name(len(grid_p1)-1, len(grid_p1[0])-1)
-    total_risk_p1 = nx.shortest_path_length(graph_p1, start_node_p1, finish_node_p1, "edge_risk")
+    total_risk_p1 = engine(grid_p1)
     print(f"least total risk = {total_risk_p1}") # 415
 
     print("Part 2")
-    grid_p2 = grid_from_input_p2(input15)
-    graph_p2 = graph_from_grid(grid_p2)
-    start_node_p2 = node_name(0, 0)
-    finish_node_p2 = node_name(len(grid_p2)-1, len(grid_p2[0])-1)
-    total_risk_p2 = nx.shortest_path_length(graph_p2, start_node_p2, finish_node_p2, "edge_risk")
-    print(f"least total risk = {total_risk_p2}") # 
+    grid_p2 = grid_from_input_tiled(input15) if engine is not least_total_risk_networkx else grid_from_input_p2(input15)
+    total_risk_p2 = engine(grid_p2)
+    print(f"least total risk = {total_risk_p2}") # 2864
+
+    if "--benchmark" in sys.argv:
+        for name, (total_risk, seconds) in benchmark_engines(grid_p2, ["dijkstra", "dial", "astar", "bidirectional"]).items():
+            print(f"{name}: least total risk = {total_risk} in {seconds:.3f}s")
+
+    if "--expanded" in sys.argv:
+        for name, (total_risk, expanded) in nodes_expanded_by_mode(grid_p2).items():
+            print(f"{name}: least total risk = {total_risk} after expanding {expanded} of {len(grid_p2)} nodes")
 
 
 ###############################################################################
@@ -137,6 +753,8 @@ def test_grid_from_input_p1_sample():
     assert expected == computed
 
 def test_graph_from_grid_sample():
+    import pytest
+    pytest.importorskip("networkx")
     grid = grid_from_input_p1(SAMPLE_INPUT)
     graph = graph_from_grid(grid)
 
@@ -153,6 +771,8 @@ def test_graph_from_grid_sample():
     assert graph.edges[node_name(2,1), node_name(2,0)] == {"edge_risk": 6}
 
 def test_shortest_path_sample():
+    import pytest
+    nx = pytest.importorskip("networkx")
     grid = grid_from_input_p1(SAMPLE_INPUT)
     graph = graph_from_grid(grid)
 
@@ -241,3 +861,223 @@ def test_grid_from_input_p2_sample():
     ]
     computed = grid_from_input_p2(SAMPLE_INPUT)
     assert expected == computed
+
+def test_flatten_grid():
+    risks, width, height = flatten_grid([[1,2,3],[4,5,6]])
+    assert risks == [1,2,3,4,5,6]
+    assert (width, height) == (3, 2)
+
+def test_dijkstra_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    assert least_total_risk_dijkstra(grid) == 40
+
+def test_dijkstra_p2_sample():
+    grid = grid_from_input_p2(SAMPLE_INPUT)
+    assert least_total_risk_dijkstra(grid) == 315
+
+def test_dijkstra_matches_networkx_non_square():
+    import pytest
+    pytest.importorskip("networkx")
+    grid = [
+        [1,9,9,9,9,9],
+        [1,1,1,9,1,1],
+        [9,9,1,1,1,9],
+    ]
+    assert least_total_risk_dijkstra(grid) == least_total_risk_networkx(grid) == 15
+
+def test_dial_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    assert least_total_risk_dial(grid) == 40
+
+def test_dial_p2_sample():
+    grid = grid_from_input_p2(SAMPLE_INPUT)
+    assert least_total_risk_dial(grid) == 315
+
+def test_dial_matches_dijkstra_non_square():
+    grid = [
+        [1,9,9,9,9,9],
+        [1,1,1,9,1,1],
+        [9,9,1,1,1,9],
+    ]
+    assert least_total_risk_dial(grid) == least_total_risk_dijkstra(grid) == 15
+
+def test_tiled_grid_matches_p2_sample():
+    expected, width, height = flatten_grid(grid_from_input_p2(SAMPLE_INPUT))
+    tiled = grid_from_input_tiled(SAMPLE_INPUT)
+    assert (tiled.width, tiled.height) == (width, height) == (50, 50)
+    assert len(tiled) == len(expected)
+    assert [tiled[i] for i in range(len(tiled))] == expected
+
+def test_tiled_grid_tiny():
+    tiled = grid_from_input_tiled("8", tile_factor=12)
+    assert [tiled.risk(x, 0) for x in range(12)] == [8,9,1,2,3,4,5,6,7,8,9,1]
+    assert tiled.risk(11, 11) == wrap_1_to_9(8 + 22)
+
+def test_dial_tiled_p2_sample():
+    assert least_total_risk_dial(grid_from_input_tiled(SAMPLE_INPUT)) == 315
+    assert least_total_risk_dijkstra(grid_from_input_tiled(SAMPLE_INPUT)) == 315
+
+def test_astar_and_bidirectional_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    assert least_total_risk_astar(grid) == 40
+    assert least_total_risk_bidirectional(grid) == 40
+
+def test_astar_and_bidirectional_p2_sample():
+    grid = grid_from_input_tiled(SAMPLE_INPUT)
+    assert least_total_risk_astar(grid) == 315
+    assert least_total_risk_bidirectional(grid) == 315
+
+def test_astar_and_bidirectional_non_square():
+    grid = [
+        [1,9,9,9,9,9],
+        [1,1,1,9,1,1],
+        [9,9,1,1,1,9],
+    ]
+    assert least_total_risk_astar(grid) == 15
+    assert least_total_risk_bidirectional(grid) == 15
+    assert least_total_risk_bidirectional([[5]]) == 0
+
+def test_tiled_grid_min_risk():
+    assert grid_from_input_tiled("8", tile_factor=1).min_risk == 8
+    assert grid_from_input_tiled("8", tile_factor=2).min_risk == 1
+    assert grid_from_input_tiled("5", tile_factor=2).min_risk == 5
+
+def test_nodes_expanded_by_mode_sample():
+    results = nodes_expanded_by_mode(grid_from_input_tiled(SAMPLE_INPUT))
+    assert {total_risk for total_risk, _ in results.values()} == {315}
+    assert all(0 < expanded <= 2500 for _, expanded in results.values())
+
+def test_csr_from_grid_sample():
+    import pytest
+    pytest.importorskip("numpy")
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    graph = csr_from_grid(grid)
+    assert graph.node_count == 100
+    assert len(graph.targets) == len(graph.weights) == 2*2*10*9 # 2 directions over 9 gaps in each of 10 rows and 10 columns
+
+    # (2,0) has left, right and down neighbours, the edge into (2,1) costs 8
+    i = 2
+    out_edges = dict(zip(graph.targets[graph.offsets[i]:graph.offsets[i+1]], graph.weights[graph.offsets[i]:graph.offsets[i+1]]))
+    assert out_edges == {1: 1, 3: 3, 12: 8}
+
+def test_csr_from_grid_tiled_matches_materialised():
+    import pytest
+    pytest.importorskip("numpy")
+    tiled = grid_from_input_tiled(SAMPLE_INPUT)
+    graph = csr_from_grid(tiled)
+    expected = csr_from_grid(grid_from_input_p2(SAMPLE_INPUT))
+    assert (graph.offsets, graph.targets, graph.weights) == (expected.offsets, expected.targets, expected.weights)
+    assert graph.node_risks is tiled
+
+def test_csr_from_grid_large_tile_factor():
+    import pytest
+    pytest.importorskip("numpy")
+    # 9 + 2*69 overflows int8, every edge weight must still match the lazy grid
+    tiled = grid_from_input_tiled("89\n98", tile_factor=70)
+    graph = csr_from_grid(tiled)
+    assert list(graph.weights) == [tiled[j] for j in graph.targets]
+    assert least_total_risk_csr(tiled) == least_total_risk_dial(tiled)
+
+def test_dijkstra_csr_sample():
+    import pytest
+    pytest.importorskip("numpy")
+    assert least_total_risk_csr(grid_from_input_p1(SAMPLE_INPUT)) == 40
+    assert least_total_risk_csr(grid_from_input_tiled(SAMPLE_INPUT)) == 315
+
+def test_csr_from_grid_loop_matches_csr_from_grid():
+    # the no-numpy fallback, which also has to run where numpy is missing
+    for grid, total_risk in ((grid_from_input_p1(SAMPLE_INPUT), 40), (grid_from_input_tiled(SAMPLE_INPUT), 315)):
+        graph = csr_from_grid_loop(grid)
+        risks, _, _ = flat_view(grid)
+        assert list(graph.weights) == [risks[j] for j in graph.targets]
+        assert dijkstra_csr(graph) == total_risk
+        if load_numpy() is not None:
+            expected = csr_from_grid(grid)
+            assert (graph.offsets, graph.targets, graph.weights) == (expected.offsets, expected.targets, expected.weights)
+
+def test_dijkstra_csr_non_grid():
+    # a ring of 4 nodes where the long way round is cheaper
+    graph = CsrGraph(
+        offsets=array("l", [0, 2, 4, 6, 8]),
+        targets=array("l", [1, 3, 0, 2, 1, 3, 2, 0]),
+        weights=array("b", [1, 9, 1, 1, 1, 1, 1, 1]),
+    )
+    assert dijkstra_csr(graph, 0, 3) == 3
+
+    import pytest
+    pytest.importorskip("networkx")
+    assert len(graph.to_networkx().edges()) == 8
+
+def test_distance_map_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    risks, width, height = flatten_grid(grid)
+    distance_map = distance_map_flat(risks, width, height)
+    assert distance_map.distance_to(9, 9) == 40
+    assert distance_map.distance_to(0, 0) == 0
+    assert distance_map.distance_to(1, 0) == 1
+
+    path = distance_map.path_to(9, 9)
+    assert path[0] == (0, 0) and path[-1] == (9, 9)
+    assert sum(grid[y][x] for x, y in path[1:]) == 40
+    for (x1, y1), (x2, y2) in zip(path, path[1:]):
+        assert abs(x1-x2) + abs(y1-y2) == 1
+
+def test_distance_map_cache():
+    cache = DistanceMapCache(max_grids=2)
+    grid_a = grid_from_input_p1(SAMPLE_INPUT)
+    grid_b = grid_from_input_tiled(SAMPLE_INPUT)
+    grid_c = [[1,2],[3,4]]
+
+    assert cache.get(grid_a).distance_to(9, 9) == 40
+    assert cache.get(grid_from_input_p1(SAMPLE_INPUT)).distance_to(5, 5) == dijkstra_flat(*flatten_grid(grid_a), finish=55)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    assert cache.get(grid_b).distance_to(49, 49) == 315
+    assert cache.get(grid_c).distance_to(1, 1) == 6 # evicts grid_a
+    assert len(cache.maps) == 2
+    cache.get(grid_a)
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert len(cache.grid_keys) == 2 # grid_a again and grid_c, grid_b went with its map
+
+def test_distance_map_cache_bounds_grids_not_starts():
+    cache = DistanceMapCache(max_grids=2)
+    grid_a = grid_from_input_p1(SAMPLE_INPUT)
+    grid_c = [[1,2],[3,4]]
+    cache.get(grid_c)
+    for x in range(10):
+        cache.get(grid_a, (x, 0))
+    assert len(cache.maps) == 2 # ten starts on grid_a don't push grid_c out
+    cache.get(grid_c)
+    assert (cache.hits, cache.misses) == (1, 11)
+
+def test_distance_map_cache_hashes_each_grid_once(monkeypatch):
+    hashed = []
+    original_grid_hash = grid_hash
+    monkeypatch.setattr(sys.modules[__name__], "grid_hash", lambda grid: hashed.append(grid) or original_grid_hash(grid))
+    cache = DistanceMapCache()
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    for x in range(10):
+        assert cache.get(grid).distance_to(x, 0) == dijkstra_flat(*flatten_grid(grid), finish=x)
+    assert len(hashed) == 1
+    assert (cache.hits, cache.misses) == (9, 1)
+
+def test_least_total_risk_to_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    assert least_total_risk_to(grid, 9, 9) == 40
+    assert least_total_risk_to(grid, 0, 0) == 0
+
+def test_least_total_risk_batch_sample():
+    grids = [
+        grid_from_input_p1(SAMPLE_INPUT),
+        grid_from_input_p2(SAMPLE_INPUT),
+        [[1,9,9,9,9,9],[1,1,1,9,1,1],[9,9,1,1,1,9]],
+        [[7]],
+    ]
+    assert least_total_risk_batch(grids, workers=2) == [40, 315, 15, 0]
+    assert least_total_risk_batch([]) == []
+
+def test_least_total_risk_pairs_sample():
+    grid = grid_from_input_p1(SAMPLE_INPUT)
+    pairs = [((0, 0), (9, 9)), ((9, 9), (0, 0)), ((2, 0), (2, 1)), ((3, 3), (3, 3))]
+    expected = [40, dijkstra_flat(*flatten_grid(grid), start=99, finish=0), 8, 0]
+    assert least_total_risk_pairs(grid, pairs, workers=3) == expected
@@ -1,7 +1,201 @@
+import os
 import re
+import sys
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from math import floor, ceil
 
 
+# one reduction step, recorded when a trace list is passed in; position is the index of the affected regular number
+# in the flat form (see sf_parse), before and after are the whole number formatted as a string
+TraceStep = namedtuple("TraceStep", ["operation", "position", "before", "after"])
+
+
+def sf_parse(sf) -> list[list[int]]: # [[value, depth], ...]
+    # flattens the tree to its regular numbers left to right, each with the number of pairs it sits inside;
+    # the tree can always be rebuilt from this (see sf_format) and explode/split/magnitude only need neighbours
+    flat = []
+    depth = 0
+    i = 0
+    while i < len(sf):
+        c = sf[i]
+        if c == "[":
+            depth += 1
+        elif c == "]":
+            depth -= 1
+        elif c.isdigit():
+            j = i + 1
+            while j < len(sf) and sf[j].isdigit():
+                j += 1
+            flat.append([int(sf[i:j]), depth])
+            i = j
+            continue
+        i += 1
+    return flat
+
+
+def sf_format(flat) -> str:
+    # rebuild the tree by merging the two top entries whenever they sit at the same depth,
+    # the same thing sf_flat_magnitude does with numbers instead of strings
+    stack = []
+    for value, depth in flat:
+        stack.append((str(value), depth))
+        while len(stack) > 1 and stack[-1][1] == stack[-2][1]:
+            right, depth = stack.pop()
+            left, _ = stack.pop()
+            stack.append((f"[{left},{right}]", depth-1))
+    return stack[0][0]
+
+
+def sf_flat_find_exploding_pair(flat, start=0) -> int: # index of the pair's left number, or None
+    # the leftmost two neighbours at the same depth inside 4 or more pairs are always a pair of regular numbers
+    for i in range(start, len(flat)-1):
+        if flat[i][1] > 4 and flat[i][1] == flat[i+1][1]:
+            return i
+    return None
+
+
+def sf_flat_explode_at(flat, i) -> None: # mutates flat
+    left, depth = flat[i]
+    right = flat[i+1][0]
+    if i > 0:
+        flat[i-1][0] += left
+    if i+2 < len(flat):
+        flat[i+2][0] += right
+    flat[i:i+2] = [[0, depth-1]]
+
+
+def sf_flat_explode(flat) -> bool: # mutates flat, returns changed flag
+    i = sf_flat_find_exploding_pair(flat)
+    if i is None:
+        return False
+    sf_flat_explode_at(flat, i)
+    return True
+
+
+def sf_flat_find_splitting_number(flat, start=0) -> int: # index, or None
+    for i in range(start, len(flat)):
+        if flat[i][0] > 9:
+            return i
+    return None
+
+
+def sf_flat_split_at(flat, i) -> None: # mutates flat
+    value, depth = flat[i]
+    flat[i:i+1] = [[floor(value / 2), depth+1], [ceil(value / 2), depth+1]]
+
+
+def sf_flat_split(flat) -> bool: # mutates flat, returns changed flag
+    i = sf_flat_find_splitting_number(flat)
+    if i is None:
+        return False
+    sf_flat_split_at(flat, i)
+    return True
+
+
+def sf_flat_reduce(flat, trace=None) -> bool: # mutates flat, returns changed flag
+    i = sf_flat_find_exploding_pair(flat)
+    if i is not None:
+        sf_flat_traced(flat, "explode", i, sf_flat_explode_at, trace)
+        return True
+
+    i = sf_flat_find_splitting_number(flat)
+    if i is not None:
+        sf_flat_traced(flat, "split", i, sf_flat_split_at, trace)
+        return True
+
+    return False
+
+
+def sf_flat_traced(flat, operation, i, step, trace) -> None: # mutates flat, and trace if it isn't None
+    # formatting before/after costs as much as the step itself, so it only happens when someone asked for a trace
+    if trace is None:
+        step(flat, i)
+        return
+    before = sf_format(flat)
+    step(flat, i)
+    trace.append(TraceStep(operation, i, before, sf_format(flat)))
+
+
+def sf_flat_reduce_fully(flat, trace=None) -> None: # mutates flat
+    # gives the same result as repeating sf_flat_reduce, without restarting from the left end after every step
+
+    # explosions first, in one left-to-right pass; an explosion only touches its neighbours, and the 0 it leaves
+    # can only form a new exploding pair with the number to its left, so step back one and carry on
+    i = 0
+    while i < len(flat)-1:
+        if flat[i][1] > 4 and flat[i][1] == flat[i+1][1]:
+            sf_flat_traced(flat, "explode", i, sf_flat_explode_at, trace)
+            i = max(i-1, 0)
+        else:
+            i += 1
+
+    # then splits; nothing is nested deeper than 4 any more, so the only possible explosion is the pair a split
+    # just made, and that explosion can only push the number to its left over 9, so resume from there
+    i = sf_flat_find_splitting_number(flat)
+    while i is not None:
+        sf_flat_traced(flat, "split", i, sf_flat_split_at, trace)
+        if flat[i][1] > 4:
+            sf_flat_traced(flat, "explode", i, sf_flat_explode_at, trace)
+            i = max(i-1, 0)
+        i = sf_flat_find_splitting_number(flat, i)
+
+
+def sf_flat_add(a, b) -> list[list[int]]: # new flat number, a and b are left untouched
+    return [[value, depth+1] for value, depth in a] + [[value, depth+1] for value, depth in b]
+
+
+def sf_flat_add_with_reduction(a, b, trace=None) -> list[list[int]]: # new flat number
+    flat = sf_flat_add(a, b)
+    sf_flat_reduce_fully(flat, trace)
+    return flat
+
+
+def sf_flat_magnitude(flat) -> int:
+    # same merge as sf_format, each pair of equal-depth entries on top of the stack collapses to 3*left + 2*right
+    stack = []
+    for value, depth in flat:
+        stack.append((value, depth))
+        while len(stack) > 1 and stack[-1][1] == stack[-2][1]:
+            right, depth = stack.pop()
+            left, _ = stack.pop()
+            stack.append((3*left + 2*right, depth-1))
+    return stack[0][0]
+
+
+def sf_flat_key(flat) -> tuple: # hashable, canonical form of a flat number
+    return tuple(map(tuple, flat))
+
+
+class SfAdditionCache:
+    # reduced sums and their magnitudes keyed on both operands' flat forms, least recently used evicted past max_size;
+    # a sum that comes from the cache adds nothing to a trace, since no reduction steps were run for it
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def add_with_reduction(self, a, b, trace=None) -> (list[list[int]], int): # (new flat number, its magnitude)
+        key = (sf_flat_key(a), sf_flat_key(b))
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            reduced, magnitude = self.entries[key]
+        else:
+            self.misses += 1
+            flat = sf_flat_add_with_reduction(a, b, trace)
+            reduced, magnitude = sf_flat_key(flat), sf_flat_magnitude(flat)
+            self.entries[key] = (reduced, magnitude)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return [list(item) for item in reduced], magnitude
+
+
+###############################################################################
+## string versions, kept for compatibility, they parse, work on the flat form, and format the result
+
 def find_exploding_pair(sf) -> (str, int): # (match, pos)
     depth = 0
     for i in range(len(sf)):
@@ -17,43 +211,14 @@ def find_exploding_pair(sf) -> (str, int): # (match, pos)
     return None, None
 
 
-def sf_explode(sf) -> (str, bool): # (new string, changed flag)
-    target, pos = find_exploding_pair(sf)
-    if target is None:
+def sf_explode(sf, trace=None) -> (str, bool): # (new string, changed flag)
+    flat = sf_parse(sf)
+    i = sf_flat_find_exploding_pair(flat)
+    if i is None:
         return sf, False
 
-    print(f"exploding {target}... {sf}")
-
-    left_remaining = sf[0:pos]
-    right_remaining = sf[pos+len(target):]
-    #print(f"L/R remaining: {left_remaining} | {right_remaining}")
-
-    exp_left, exp_right = map(int, target.strip("[]").split(","))
-    recip_left = list(re.finditer(r"[0-9]+", left_remaining))
-    recip_right = list(re.finditer(r"[0-9]+", right_remaining))
-
-    if recip_left:
-        left_match = recip_left[-1]
-        #print(f"left_match={left_match}")
-        recip_left_start = left_match.start(0)
-        recip_left_end = left_match.end(0)
-        recip_left_num = int(left_match[0])
-        new_left_num = recip_left_num + exp_left
-        left_remaining = left_remaining[0:recip_left_start] + str(new_left_num) + left_remaining[recip_left_end:]
-
-    if recip_right:
-        right_match = recip_right[0]
-        #print(f"right_match={right_match}")
-        recip_right_start = right_match.start(0)
-        recip_right_end = right_match.end(0)
-        recip_right_num = int(right_match[0])
-        new_right_num = recip_right_num + exp_right
-        right_remaining = right_remaining[0:recip_right_start] + str(new_right_num) + right_remaining[recip_right_end:]
-
-    new_sf = f"{left_remaining}0{right_remaining}"
-    #print(f"new_sf={new_sf}")
-
-    return new_sf, True
+    sf_flat_traced(flat, "explode", i, sf_flat_explode_at, trace)
+    return sf_format(flat), True
 
 
 def find_splitting_number(sf) -> (str, int): # (match, pos)
@@ -64,120 +229,184 @@ def find_splitting_number(sf) -> (str, int): # (match, pos)
         return None, None
 
 
-def sf_split(sf) -> (str, bool): # (new string, changed flag)
-    target, pos = find_splitting_number(sf)
-    if target is None:
+def sf_split(sf, trace=None) -> (str, bool): # (new string, changed flag)
+    flat = sf_parse(sf)
+    i = sf_flat_find_splitting_number(flat)
+    if i is None:
         return sf, False
 
-    print(f"splitting {target}... {sf}")
-
-    left_remaining = sf[0:pos]
-    right_remaining = sf[pos+len(target):]
+    sf_flat_traced(flat, "split", i, sf_flat_split_at, trace)
+    return sf_format(flat), True
 
-    new_left = floor(int(target) / 2)
-    new_right = ceil(int(target) / 2)
 
-    new_sf = f"{left_remaining}[{new_left},{new_right}]{right_remaining}"
-
-    return new_sf, True
-
-
-def sf_reduce(sf) -> (str, bool): # (new string, changed flag)
-    new_sf, changed = sf_explode(sf)
+def sf_reduce(sf, trace=None) -> (str, bool): # (new string, changed flag)
+    new_sf, changed = sf_explode(sf, trace)
     if changed:
         return new_sf, changed
 
-    new_sf, changed = sf_split(sf)
+    new_sf, changed = sf_split(sf, trace)
     if changed:
         return new_sf, changed
 
     return sf, False
 
 
-def sf_reduce_fully(sf) -> str: # new string
-    new_sf, changed = sf_reduce(sf)
-    while changed:
-        print(f"continuing reduction...")
-        new_sf, changed = sf_reduce(new_sf)
-    print("reduction complete")
-    return new_sf
+def sf_reduce_fully(sf, trace=None) -> str: # new string
+    flat = sf_parse(sf)
+    sf_flat_reduce_fully(flat, trace)
+    return sf_format(flat)
 
 
 def sf_add(a, b) -> str: # new string
     return f"[{a},{b}]"
 
 
-def sf_add_with_reduction(a, b) -> str: # new string
-    new_sf = sf_add(a, b)
-    return sf_reduce_fully(new_sf)
+def sf_add_with_reduction(a, b, trace=None, cache=None) -> str: # new string
+    if cache is not None:
+        flat, _ = cache.add_with_reduction(sf_parse(a), sf_parse(b), trace)
+        return sf_format(flat)
+    return sf_format(sf_flat_add_with_reduction(sf_parse(a), sf_parse(b), trace))
 
 
 def sf_magnitude(sf) -> int:
-    if sf[0] == "[":
-        comma_idx = None
-        close_bracket_idx = None
-        depth = 0
-
-        for i in range(1,len(sf)):
-            if sf[i] == "]" and depth == 0:
-                close_bracket_idx = i
-                break
-
-            if sf[i] == "," and depth == 0:
-                comma_idx = i
-
-            if sf[i] == "[":
-                depth += 1
-            elif sf[i] == "]":
-                depth -= 1
-
-        return (3 * sf_magnitude(sf[1:comma_idx])) + (2 * sf_magnitude(sf[comma_idx+1:close_bracket_idx]))
-
-    elif sf[0] == "]":
-        raise Exception("unexpected ]")
-    elif sf[0] == ",":
-        raise Exception("unexpected ,")
-    else:
-        num_string = sf[0]
-        for i in range(1,len(sf)):
-            if sf[i].isdigit():
-                num_string += sf[i]
+    # one pass with a stack of magnitudes: a number pushes itself and each "]" collapses the top two as 3*left + 2*right;
+    # flat numbers from sf_parse are handled the same way by sf_flat_magnitude
+    if isinstance(sf, list):
+        return sf_flat_magnitude(sf)
+
+    stack = []
+    i = 0
+    while i < len(sf):
+        c = sf[i]
+        if c.isdigit():
+            j = i + 1
+            while j < len(sf) and sf[j].isdigit():
+                j += 1
+            stack.append(int(sf[i:j]))
+            i = j
+            continue
+        elif c == "]":
+            if len(stack) < 2:
+                raise Exception("unexpected ]")
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(3*left + 2*right)
+        elif c == "," and not stack:
+            raise Exception("unexpected ,")
+        i += 1
+
+    return stack[0]
+
+
+def sf_list_magnitude(sf_list, trace=None, cache=None, progress=None):
+    # sf_list can be any iterable of lines, e.g. an open file, only the running sum is kept in memory;
+    # blank lines are skipped and progress, if given, is called with the count of numbers folded in so far
+    # with a cache, runs over lists that share a prefix reuse every partial sum of that prefix
+    acc = None
+    count = 0
+    for sf in sf_list:
+        sf = sf.strip()
+        if not sf:
+            continue
+
+        number = sf_parse(sf)
+        if acc is None:
+            acc = number
+        elif cache is not None:
+            acc, _ = cache.add_with_reduction(acc, number, trace)
+        else:
+            acc = sf_flat_add_with_reduction(acc, number, trace)
+
+        count += 1
+        if progress is not None:
+            progress(count)
+
+    if acc is None:
+        raise ValueError("no snailfish numbers to add")
+    return sf_flat_magnitude(acc)
+
+
+def sf_max_pair_magnitude(sf_list, trace=None, cache=None):
+    parsed = [sf_parse(sf) for sf in sf_list]
+    max_magnitude = 0
+    for i in range(len(parsed)):
+        for j in range(len(parsed)):
+            if i == j:
+                continue
+            if cache is not None:
+                _, magnitude = cache.add_with_reduction(parsed[i], parsed[j], trace)
             else:
-                break
+                magnitude = sf_flat_magnitude(sf_flat_add_with_reduction(parsed[i], parsed[j], trace))
+            max_magnitude = max(max_magnitude, magnitude)
+    return max_magnitude
+
 
-        return int(num_string)
+_shared_parsed = None # set in each worker by _init_pair_worker
 
 
-def sf_list_magnitude(sf_list):
-    acc = sf_list[0]
-    for sf in sf_list[1:]:
-        acc = sf_add_with_reduction(acc, sf)
-    return sf_magnitude(acc)    
+def _init_pair_worker(parsed):
+    global _shared_parsed
+    _shared_parsed = parsed
 
 
-def sf_max_pair_magnitude(sf_list):
+def _max_pair_magnitude_for_rows(rows) -> int: # max over (i, j) for i in rows and every j != i
     max_magnitude = 0
-    for i in range(len(sf_list)):
-        for j in range(len(sf_list)):
+    for i in rows:
+        for j in range(len(_shared_parsed)):
             if i == j:
                 continue
-            magnitude = sf_magnitude(sf_add_with_reduction(sf_list[i], sf_list[j]))
+            magnitude = sf_flat_magnitude(sf_flat_add_with_reduction(_shared_parsed[i], _shared_parsed[j]))
             max_magnitude = max(max_magnitude, magnitude)
     return max_magnitude
 
 
+def sf_max_pair_magnitude_parallel(sf_list, workers=None) -> int:
+    # the numbers are parsed once and handed to each worker once via the pool initializer,
+    # after that only lists of row indexes cross process boundaries
+    workers = workers or os.cpu_count() or 1
+    parsed = [sf_parse(sf) for sf in sf_list]
+    chunk_count = min(len(parsed), workers*4) # a few chunks per worker evens out uneven rows
+    chunks = [list(range(n, len(parsed), chunk_count)) for n in range(chunk_count)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pair_worker, initargs=(parsed,)) as executor:
+        return max(executor.map(_max_pair_magnitude_for_rows, chunks), default=0)
+
+
+def benchmark_tracing(sf_list) -> dict: # {"silent" / "traced": (max pair magnitude, reduction steps, seconds)}
+    results = {}
+    for name, trace in [("silent", None), ("traced", [])]:
+        started = time.perf_counter()
+        max_pair_magnitude = sf_max_pair_magnitude(sf_list, trace)
+        results[name] = (max_pair_magnitude, len(trace) if trace is not None else None, time.perf_counter() - started)
+    return results
+
+
 if __name__ == "__main__":
     input18 = open("input18", encoding="utf-8").read().strip()
 
     print("Part 1")
     input_lines = input18.split("\n")
-    magnitude_of_input = sf_list_magnitude(input_lines)
+    trace = [] if "--trace" in sys.argv else None
+    magnitude_of_input = sf_list_magnitude(input_lines, trace)
+    for step in trace or []:
+        print(f"{step.operation} at {step.position}: {step.before} -> {step.after}")
     print(f"(p1 answer) magnitude of all input added = {magnitude_of_input}") # 3734
 
     print("Part 2")
-    max_pair_magnitude = sf_max_pair_magnitude(input_lines)
+    if "--workers" in sys.argv:
+        # --workers N spreads the pairs over a process pool, N=0 or no N means one worker per CPU
+        following = sys.argv[sys.argv.index("--workers")+1:]
+        if following and not following[0].startswith("--") and not following[0].isdigit():
+            sys.exit(f"usage: {sys.argv[0]} [--trace] [--benchmark] [--workers N], got --workers {following[0]}")
+        workers = int(following[0]) if following and following[0].isdigit() else 0
+        max_pair_magnitude = sf_max_pair_magnitude_parallel(input_lines, workers)
+    else:
+        max_pair_magnitude = sf_max_pair_magnitude(input_lines)
     print(f"(p2 answer) max magnitude from adding two numbers = {max_pair_magnitude}") # 4837
 
+    if "--benchmark" in sys.argv:
+        for name, (magnitude, steps, seconds) in benchmark_tracing(input_lines).items():
+            print(f"{name}: max magnitude {magnitude}, {steps or 'untracked'} steps, {seconds:.3f}s")
+
 
 ###############################################################################
 
@@ -373,3 +602,156 @@ def test_max_magnitude_of_pair(): # part 2
     expected = 3993
     computed = sf_max_pair_magnitude(input_list)
     assert expected == computed
+
+
+def test_parse_and_format():
+    sf = "[[[[0,7],4],[[7,8],[6,0]]],[8,1]]"
+    flat = sf_parse(sf)
+    assert flat[:3] == [[0,4], [7,4], [4,3]]
+    assert sf_format(flat) == sf
+    assert sf_parse("[10,[2,13]]") == [[10,1], [2,2], [13,2]]
+    assert sf_format(sf_parse("[10,[2,13]]")) == "[10,[2,13]]"
+
+def test_flat_explode_matches_string_examples():
+    for before, after in [
+        ("[[[[[9,8],1],2],3],4]", "[[[[0,9],2],3],4]"),
+        ("[7,[6,[5,[4,[3,2]]]]]", "[7,[6,[5,[7,0]]]]"),
+        ("[[3,[2,[1,[7,3]]]],[6,[5,[4,[3,2]]]]]", "[[3,[2,[8,0]]],[9,[5,[4,[3,2]]]]]"),
+    ]:
+        flat = sf_parse(before)
+        assert sf_flat_explode(flat)
+        assert sf_format(flat) == after
+
+def test_flat_split():
+    flat = sf_parse("[[[[0,7],4],[15,[0,13]]],[1,1]]")
+    assert sf_flat_split(flat)
+    assert sf_format(flat) == "[[[[0,7],4],[[7,8],[0,13]]],[1,1]]"
+    assert not sf_flat_split(sf_parse("[1,9]"))
+
+def test_flat_magnitude():
+    assert sf_flat_magnitude(sf_parse("[[1,2],[[3,4],5]]")) == 143
+    assert sf_flat_magnitude(sf_parse("[[[[8,7],[7,7]],[[8,6],[7,7]]],[[[0,7],[6,6]],[8,7]]]")) == 3488
+    assert sf_flat_magnitude(sf_parse("9")) == 9
+
+def sf_flat_reduce_stepped(flat) -> None: # mutates flat, one explode or split per step like sf_reduce
+    while sf_flat_reduce(flat):
+        pass
+
+def test_flat_reduce_fully_matches_stepped():
+    sf_list = [
+        "[[[0,[5,8]],[[1,7],[9,6]]],[[4,[1,2]],[[1,4],2]]]",
+        "[[[5,[2,8]],4],[5,[[9,9],0]]]",
+        "[6,[[[6,2],[5,6]],[[7,6],[4,7]]]]",
+        "[[[6,[0,7]],[0,9]],[4,[9,[9,0]]]]",
+        "[[[7,[6,4]],[3,[1,3]]],[[[5,5],1],9]]",
+        "[[6,[[7,3],[3,2]]],[[[3,8],[5,7]],4]]",
+        "[[[[5,4],[7,7]],8],[[8,3],8]]",
+        "[[9,3],[[9,9],[6,[4,9]]]]",
+        "[[2,[[7,7],7]],[[5,8],[[9,3],[0,2]]]]",
+        "[[[[5,2],5],[8,[3,7]]],[[5,[7,5]],[4,4]]]",
+        "[[[[[4,3],4],4],[7,[[8,4],9]]],[1,1]]",
+        "[[[[[[1,2],3],4],5],6],[29,[[[[[[30,1],2],3],4],5],6]]]", # deeper than any reduced sum gets, and a split that splits again
+    ]
+    for a in sf_list:
+        for b in sf_list:
+            batch = sf_flat_add(sf_parse(a), sf_parse(b))
+            stepped = sf_flat_add(sf_parse(a), sf_parse(b))
+            sf_flat_reduce_fully(batch)
+            sf_flat_reduce_stepped(stepped)
+            assert batch == stepped
+
+    flat = sf_parse("[[[[[4,3],4],4],[7,[[8,4],9]]],[1,1]]")
+    sf_flat_reduce_fully(flat)
+    assert sf_format(flat) == "[[[[0,7],4],[[7,8],[6,0]]],[8,1]]"
+
+def test_max_magnitude_of_pair_parallel():
+    input_list = [
+        "[[[0,[5,8]],[[1,7],[9,6]]],[[4,[1,2]],[[1,4],2]]]",
+        "[[[5,[2,8]],4],[5,[[9,9],0]]]",
+        "[6,[[[6,2],[5,6]],[[7,6],[4,7]]]]",
+        "[[[6,[0,7]],[0,9]],[4,[9,[9,0]]]]",
+        "[[[7,[6,4]],[3,[1,3]]],[[[5,5],1],9]]",
+        "[[6,[[7,3],[3,2]]],[[[3,8],[5,7]],4]]",
+        "[[[[5,4],[7,7]],8],[[8,3],8]]",
+        "[[9,3],[[9,9],[6,[4,9]]]]",
+        "[[2,[[7,7],7]],[[5,8],[[9,3],[0,2]]]]",
+        "[[[[5,2],5],[8,[3,7]]],[[5,[7,5]],[4,4]]]",
+    ]
+    assert sf_max_pair_magnitude_parallel(input_list, workers=3) == 3993
+
+def test_reduce_fully_trace():
+    trace = []
+    sf = sf_reduce_fully("[[[[[4,3],4],4],[7,[[8,4],9]]],[1,1]]", trace)
+    assert sf == "[[[[0,7],4],[[7,8],[6,0]]],[8,1]]"
+    assert [step.operation for step in trace] == ["explode", "explode", "split", "split", "explode"]
+    assert trace[0] == TraceStep("explode", 0, "[[[[[4,3],4],4],[7,[[8,4],9]]],[1,1]]", "[[[[0,7],4],[7,[[8,4],9]]],[1,1]]")
+    assert trace[2].position == 3
+    assert trace[-1].after == sf
+
+def test_reduce_stepped_trace():
+    trace = []
+    sf, changed = sf_reduce("[[[[0,7],4],[15,[0,13]]],[1,1]]", trace)
+    assert trace == [TraceStep("split", 3, "[[[[0,7],4],[15,[0,13]]],[1,1]]", sf)]
+    assert sf_reduce(sf)[0] == "[[[[0,7],4],[[7,8],[0,[6,7]]]],[1,1]]"
+    assert len(trace) == 1
+
+def test_addition_cache():
+    cache = SfAdditionCache(max_size=2)
+    assert sf_add_with_reduction("[[[[4,3],4],4],[7,[[8,4],9]]]", "[1,1]", cache=cache) == "[[[[0,7],4],[[7,8],[6,0]]],[8,1]]"
+    assert sf_add_with_reduction("[[[[4,3],4],4],[7,[[8,4],9]]]", "[1,1]", cache=cache) == "[[[[0,7],4],[[7,8],[6,0]]],[8,1]]"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    flat, magnitude = cache.add_with_reduction(sf_parse("[1,1]"), sf_parse("[2,2]"))
+    assert sf_format(flat) == "[[1,1],[2,2]]"
+    assert magnitude == sf_magnitude("[[1,1],[2,2]]")
+    flat[0][0] = 99 # results are copies, the cached sum stays intact
+    assert sf_format(cache.add_with_reduction(sf_parse("[1,1]"), sf_parse("[2,2]"))[0]) == "[[1,1],[2,2]]"
+
+    cache.add_with_reduction(sf_parse("[3,3]"), sf_parse("[4,4]"))
+    assert len(cache.entries) == 2
+    assert (cache.hits, cache.misses) == (2, 3)
+
+def test_magnitudes_with_cache():
+    input_list = [
+        "[[[0,[5,8]],[[1,7],[9,6]]],[[4,[1,2]],[[1,4],2]]]",
+        "[[[5,[2,8]],4],[5,[[9,9],0]]]",
+        "[6,[[[6,2],[5,6]],[[7,6],[4,7]]]]",
+        "[[[6,[0,7]],[0,9]],[4,[9,[9,0]]]]",
+        "[[[7,[6,4]],[3,[1,3]]],[[[5,5],1],9]]",
+        "[[6,[[7,3],[3,2]]],[[[3,8],[5,7]],4]]",
+        "[[[[5,4],[7,7]],8],[[8,3],8]]",
+        "[[9,3],[[9,9],[6,[4,9]]]]",
+        "[[2,[[7,7],7]],[[5,8],[[9,3],[0,2]]]]",
+        "[[[[5,2],5],[8,[3,7]]],[[5,[7,5]],[4,4]]]",
+    ]
+    cache = SfAdditionCache()
+    assert sf_list_magnitude(input_list, cache=cache) == 4140
+    assert sf_list_magnitude(input_list, cache=cache) == 4140
+    assert (cache.hits, cache.misses) == (9, 9)
+
+    assert sf_max_pair_magnitude(input_list, cache=cache) == 3993
+    assert sf_max_pair_magnitude(input_list, cache=cache) == 3993
+    assert cache.hits == 9 + 90 + 1 # second pass is all hits, plus the first two numbers' sum from the list run
+
+def test_magnitude_of_streamed_list():
+    import io
+    input_text = """
+[[[0,[5,8]],[[1,7],[9,6]]],[[4,[1,2]],[[1,4],2]]]
+[[[5,[2,8]],4],[5,[[9,9],0]]]
+[6,[[[6,2],[5,6]],[[7,6],[4,7]]]]
+[[[6,[0,7]],[0,9]],[4,[9,[9,0]]]]
+[[[7,[6,4]],[3,[1,3]]],[[[5,5],1],9]]
+[[6,[[7,3],[3,2]]],[[[3,8],[5,7]],4]]
+[[[[5,4],[7,7]],8],[[8,3],8]]
+[[9,3],[[9,9],[6,[4,9]]]]
+[[2,[[7,7],7]],[[5,8],[[9,3],[0,2]]]]
+[[[[5,2],5],[8,[3,7]]],[[5,[7,5]],[4,4]]]
+"""
+    seen = []
+    lines = (line for line in io.StringIO(input_text)) # a one-shot iterator, like reading a file
+    assert sf_list_magnitude(lines, progress=seen.append) == 4140
+    assert seen == list(range(1, 11))
+
+def test_magnitude_of_flat_and_plain_number():
+    assert sf_magnitude(sf_parse("[[[[0,7],4],[[7,8],[6,0]]],[8,1]]")) == 1384
+    assert sf_magnitude("17") == 17
@@ -1,3 +1,4 @@
+import sys
 from collections import namedtuple, Counter
 
 
@@ -66,27 +67,111 @@ def enhance_image(in_grid: dict, algorithm: str) -> dict:
     return out_grid
 
 
+def lit_pixels_after_sparse(input_lines, algorithm, passes) -> int:
+    image = sparse_grid_from_lines(input_lines)
+    for _ in range(passes):
+        image = enhance_image(image, algorithm)
+    return Counter(image.values())["#"]
+
+
+def dense_image_from_lines(input_lines): # 2D numpy array of 0/1, rows are y
+    # numpy is only needed for the dense engine, so it isn't imported at module load
+    import numpy as np
+    return np.array([[1 if pixel == "#" else 0 for pixel in line] for line in input_lines], dtype=np.uint8)
+
+
+def enhance_dense(image, background: int, lookup) -> tuple: # (new image, new background)
+    # lookup is the algorithm as a 512-entry 0/1 array; the image grows by one pixel on every side per pass,
+    # which is as far as the finite part can influence, and everything beyond that is the new background
+    import numpy as np
+    padded = np.pad(image, 2, constant_values=background).astype(np.int16)
+    height, width = padded.shape[0]-2, padded.shape[1]-2
+
+    index = np.zeros((height, width), dtype=np.int16)
+    for dy in range(3):
+        for dx in range(3):
+            index += padded[dy:dy+height, dx:dx+width] << (8 - (3*dy + dx)) # top-left pixel weighs 256, bottom-right 1
+
+    new_background = int(lookup[511 if background else 0])
+    return lookup[index], new_background
+
+
+def lit_pixels_after_dense(input_lines, algorithm, passes) -> int:
+    import numpy as np
+    lookup = np.array([1 if pixel == "#" else 0 for pixel in algorithm], dtype=np.uint8)
+    image = dense_image_from_lines(input_lines)
+    background = 0
+    for _ in range(passes):
+        image, background = enhance_dense(image, background, lookup)
+    # only meaningful while the background is off, otherwise infinitely many pixels are lit
+    return int(image.sum())
+
+
+def bit_rows_from_lines(input_lines) -> (list[int], int): # (rows, width)
+    # each row is an int with the leftmost pixel as its highest bit, so reading 3 bits off a row
+    # gives them in the same left-to-right order as get_nine_pixel_number
+    rows = [int(line.replace(".", "0").replace("#", "1"), 2) for line in input_lines]
+    return rows, len(input_lines[0])
+
+
+def enhance_bit_rows(rows, width, background: int, lookup) -> (list[int], int, int): # (new rows, new width, new background)
+    # lookup is the algorithm as a 512-entry list of 0/1; like enhance_dense the image grows by one pixel per side,
+    # the pad of two background pixels all round covers both the new border and the windows that reach past it
+    padded_width = width + 4
+    edge = 0b11 if background else 0
+    full_row = (1 << padded_width) - 1 if background else 0
+    padded = [full_row, full_row] + [(edge << (width+2)) | (row << 2) | edge for row in rows] + [full_row, full_row]
+
+    new_width = width + 2
+    new_rows = []
+    for r in range(1, len(padded)-1):
+        top, middle, bottom = padded[r-1], padded[r], padded[r+1]
+        new_row = 0
+        for shift in range(new_width): # output bit shift is centred on padded bit shift+1
+            index = (((top >> shift) & 7) << 6) | (((middle >> shift) & 7) << 3) | ((bottom >> shift) & 7)
+            if lookup[index]:
+                new_row |= 1 << shift
+        new_rows.append(new_row)
+
+    new_background = lookup[511 if background else 0]
+    return new_rows, new_width, new_background
+
+
+def lit_pixels_after_bit_rows(input_lines, algorithm, passes) -> int:
+    lookup = [1 if pixel == "#" else 0 for pixel in algorithm]
+    rows, width = bit_rows_from_lines(input_lines)
+    background = 0
+    for _ in range(passes):
+        rows, width, background = enhance_bit_rows(rows, width, background, lookup)
+    # only meaningful while the background is off, otherwise infinitely many pixels are lit
+    return sum([bin(row).count("1") for row in rows])
+
+
+ENHANCE_ENGINES = {
+    "bitrow": lit_pixels_after_bit_rows,
+    "sparse": lit_pixels_after_sparse,
+    "numpy": lit_pixels_after_dense,
+}
+
+
 if __name__ == "__main__":
     input20 = open("input20", encoding="utf-8").read().strip()
     algorithm = input20.split("\n\n")[0]
     input_lines = input20.split("\n\n")[1].split("\n")
 
+    # e.g. `python puzzle20.py numpy`, the default needs nothing outside the standard library
+    lit_pixels_after = ENHANCE_ENGINES[sys.argv[1] if len(sys.argv) > 1 else "bitrow"]
+
     print("Part 1")
-    image = sparse_grid_from_lines(input_lines)
-    enhanced1 = enhance_image(image, algorithm)
-    enhanced2 = enhance_image(enhanced1, algorithm)
-    lit_pixels1 = Counter(enhanced2.values())["#"]
+    lit_pixels1 = lit_pixels_after(input_lines, algorithm, 2)
     print(f"(p1 answer) lit pixels after 2 enhance passes = {lit_pixels1}") # 5354
     # 5029, wrong too low
     # 5969, wrong too high
 
     print("Part 2")
-    enhanced_muchly = image
-    for _ in range(50):
-        enhanced_muchly = enhance_image(enhanced_muchly, algorithm)
-    lit_pixels2 = Counter(enhanced_muchly.values())["#"]
+    lit_pixels2 = lit_pixels_after(input_lines, algorithm, 50)
     print(f"(p2 answer) lit pixels after 50 enhance passes = {lit_pixels2}") # 18269
-    
+
 
 ###############################################################################
 
@@ -194,3 +279,66 @@ def test_enhance_large_sample_50x():
         computed = enhance_image(computed, algorithm)
     lit_pixel_count = Counter(computed.values())["#"]
     assert 3351 == lit_pixel_count
+
+
+def test_dense_matches_sparse_large_sample():
+    import pytest
+    pytest.importorskip("numpy")
+    algorithm = "..#.#..#####.#.#.#.###.##.....###.##.#..###.####..#####..#....#..#..##..###..######.###...####..#..#####..##..#.#####...##.#.#..#.##..#.#......#.###.######.###.####...#.##.##..#..#..#####.....#.#....###..#.##......#.....#..#..#..##..#...##.######.####.####.#.#...#.......#..#.#.#...####.##.#......#..#...##.#.##..#...##.#.##..###.#......#.#.......#.#.#.####.###.##...#.....####.#..#..#.##.#....##..#.####....##...##..#...#......#.#.......#.......##..####..#...#.#.#...##..#.#..###..#####........#..####......#..#"
+    lines = [
+        "#..#.",
+        "#....",
+        "##..#",
+        "..#..",
+        "..###",
+    ]
+    assert lit_pixels_after_dense(lines, algorithm, 2) == 35
+    assert lit_pixels_after_dense(lines, algorithm, 50) == 3351
+    assert lit_pixels_after_sparse(lines, algorithm, 2) == 35
+
+
+def test_enhance_dense_flips_background():
+    import pytest
+    np = pytest.importorskip("numpy")
+    lookup = np.array([1] + [0]*511, dtype=np.uint8) # everything dark turns lit and vice versa
+    image, background = enhance_dense(np.zeros((1, 1), dtype=np.uint8), 0, lookup)
+    assert background == 1
+    assert image.shape == (3, 3)
+    assert image.sum() == 9
+    image, background = enhance_dense(image, background, lookup)
+    assert background == 0
+    assert image.shape == (5, 5)
+    assert image.sum() == 0
+
+
+def test_bit_rows_match_sparse_large_sample():
+    algorithm = "..#.#..#####.#.#.#.###.##.....###.##.#..###.####..#####..#....#..#..##..###..######.###...####..#..#####..##..#.#####...##.#.#..#.##..#.#......#.###.######.###.####...#.##.##..#..#..#####.....#.#....###..#.##......#.....#..#..#..##..#...##.######.####.####.#.#...#.......#..#.#.#...####.##.#......#..#...##.#.##..#...##.#.##..###.#......#.#.......#.#.#.####.###.##...#.....####.#..#..#.##.#....##..#.####....##...##..#...#......#.#.......#.......##..####..#...#.#.#...##..#.#..###..#####........#..####......#..#"
+    lines = [
+        "#..#.",
+        "#....",
+        "##..#",
+        "..#..",
+        "..###",
+    ]
+    rows, width = bit_rows_from_lines(lines)
+    assert rows == [0b10010, 0b10000, 0b11001, 0b00100, 0b00111]
+    assert width == 5
+
+    lookup = [1 if pixel == "#" else 0 for pixel in algorithm]
+    enhanced, enhanced_width, background = enhance_bit_rows(rows, width, 0, lookup)
+    expected = enhance_image(sparse_grid_from_lines(lines), algorithm)
+    for y, row in enumerate(enhanced):
+        for x in range(enhanced_width):
+            pixel = "#" if (row >> (enhanced_width-1-x)) & 1 else "."
+            assert expected[Point(x-1, y-1)] == pixel
+
+    assert lit_pixels_after_bit_rows(lines, algorithm, 2) == 35
+    assert lit_pixels_after_bit_rows(lines, algorithm, 50) == 3351
+
+
+def test_enhance_bit_rows_flips_background():
+    lookup = [1] + [0]*511 # everything dark turns lit and vice versa
+    rows, width, background = enhance_bit_rows([0], 1, 0, lookup)
+    assert (rows, width, background) == ([0b111]*3, 3, 1)
+    rows, width, background = enhance_bit_rows(rows, width, background, lookup)
+    assert (rows, width, background) == ([0]*5, 5, 0)
@@ -1,6 +1,12 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from math import inf
 from dataclasses import dataclass
-from collections import namedtuple
+from collections import namedtuple, Counter
 from functools import cached_property
+from typing import Iterator
 
 
 #@dataclass(frozen=True)
@@ -10,6 +16,7 @@ from functools import cached_property
 #    z: int
 Point3 = namedtuple("Point3", ["x", "y", "z"])
 Point2 = namedtuple("Point2", ["x", "y"])
+Cuboid = namedtuple("Cuboid", ["x_min", "x_max", "y_min", "y_max", "z_min", "z_max"])
 
 
 @dataclass(frozen=True)
@@ -23,13 +30,9 @@ class Instruction:
     z_max: int
     is_within_init_region: bool
 
-    @cached_property
-    def xy_grid(self):
-        grid = {}
-        for x in range(self.x_min, self.x_max+1):
-            for y in range(self.y_min, self.y_max+1):
-                grid[Point2(x, y)] = self.on_or_off
-        return grid
+    @property
+    def cuboid(self) -> Cuboid:
+        return Cuboid(self.x_min, self.x_max, self.y_min, self.y_max, self.z_min, self.z_max)
 
     @cached_property
     def z_line(self):
@@ -39,22 +42,30 @@ class Instruction:
         return line
 
 
-def instructions_from_input(input_string) -> list[Instruction]:
-    out = []
-    for line in input_string.split("\n"):
-        on_off_part, ranges_part = line.split(" ")
+def instruction_from_line(line) -> Instruction:
+    on_off_part, ranges_part = line.split(" ")
+
+    on_or_off = 1 if on_off_part == "on" else 0
 
-        on_or_off = 1 if on_off_part == "on" else 0
+    x_range, y_range, z_range = ranges_part.split(",")
+    x_min, x_max = [int(v) for v in x_range[2:].split("..")]
+    y_min, y_max = [int(v) for v in y_range[2:].split("..")]
+    z_min, z_max = [int(v) for v in z_range[2:].split("..")]
+    is_within_init_region = min(x_min, y_min, z_min) >= -50 and max(x_max, y_max, z_max) <= 50
 
-        x_range, y_range, z_range = ranges_part.split(",")
-        x_min, x_max = [int(v) for v in x_range[2:].split("..")]
-        y_min, y_max = [int(v) for v in y_range[2:].split("..")]
-        z_min, z_max = [int(v) for v in z_range[2:].split("..")]
-        is_within_init_region = min(x_min, y_min, z_min) >= -50 and max(x_max, y_max, z_max) <= 50
+    return Instruction(on_or_off, x_min, x_max, y_min, y_max, z_min, z_max, is_within_init_region)
 
-        temp = Instruction(on_or_off, x_min, x_max, y_min, y_max, z_min, z_max, is_within_init_region)
-        out.append(temp)
-    return out
+
+def instructions_from_lines(lines) -> Iterator[Instruction]:
+    # lazy counterpart to instructions_from_input, e.g. over an open file; blank lines are skipped
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield instruction_from_line(line)
+
+
+def instructions_from_input(input_string) -> list[Instruction]:
+    return [instruction_from_line(line) for line in input_string.split("\n")]
 
 
 def initialize_grid(instructions: list[Instruction]) -> dict: # {Point3: int}
@@ -72,38 +83,34 @@ def initialize_grid(instructions: list[Instruction]) -> dict: # {Point3: int}
 
 
 def count_after_initialize_planar(instructions: list[Instruction]) -> int:
-    instructions = list(filter(lambda i: i.is_within_init_region, instructions))
-    overall_z_min = min([i.z_min for i in instructions if i.is_within_init_region])
-    overall_z_max = max([i.z_max for i in instructions if i.is_within_init_region])
+    return count_after_reboot_planar([i for i in instructions if i.is_within_init_region])
 
-    on_count = 0
-    for z in range(overall_z_min, overall_z_max+1):
-        print(f"z={z}")
-        grid = {}
-        for inst in instructions:
-            if not inst.z_min <= z <= inst.z_max:
-                continue
 
-            grid.update(inst.xy_grid)
+def count_xy_area(instructions: list[Instruction]) -> int: # lit area of the instructions' footprints, applied in order
+    x_edges = compress_axis([(i.x_min, i.x_max) for i in instructions])
 
-        on_count += sum(grid.values())
+    area = 0
+    for k in range(len(x_edges)-1):
+        x = x_edges[k]
+        column = [(i.y_min, i.y_max, i.on_or_off) for i in instructions if i.x_min <= x <= i.x_max]
+        area += (x_edges[k+1]-x) * lit_length(column)
 
-    return on_count
+    return area
 
 
 def count_after_reboot_planar(instructions: list[Instruction]) -> int:
-    overall_z_min = min([i.z_min for i in instructions])
-    overall_z_max = max([i.z_max for i in instructions])
+    # z slabs between instruction boundaries each see a fixed set of instructions,
+    # and slabs that see the same set share one rectangle-union computation
+    z_edges = compress_axis([(i.z_min, i.z_max) for i in instructions])
 
+    area_by_active_set = {}
     on_count = 0
-    for z in range(overall_z_min, overall_z_max+1):
-        print(f"z={z}")
-        grid = {}
-        for inst in instructions:
-            if inst.z_min <= z <= inst.z_max:
-                grid.update(inst.xy_grid)
-
-        on_count += sum(grid.values())
+    for k in range(len(z_edges)-1):
+        z = z_edges[k]
+        active = tuple(n for n, inst in enumerate(instructions) if inst.z_min <= z <= inst.z_max)
+        if active not in area_by_active_set:
+            area_by_active_set[active] = count_xy_area([instructions[n] for n in active])
+        on_count += (z_edges[k+1]-z) * area_by_active_set[active]
 
     return on_count
 
@@ -141,13 +148,14 @@ def count_after_reboot_with_ranges(instructions: list[Instruction]) -> int:
     on_count = 0
     for x in range(overall_x_min, overall_x_max+1):
         print(f"x={x} | on_count={on_count}")
+        slab_instructions = [i for i in instructions if i.x_min <= x <= i.x_max]
         for y in range(overall_y_min, overall_y_max+1):
-            line_on_range = []
-            for inst in instructions:
-                if (inst.x_min <= x <= inst.x_max and inst.y_min <= y <= inst.y_max):
-                    apply_instruction_to_z_range(line_on_range, inst)
+            line_on_range = IntervalSet()
+            for inst in slab_instructions:
+                if inst.y_min <= y <= inst.y_max:
+                    line_on_range.apply_instruction(inst)
 
-            on_count += sum_on_range(line_on_range)
+            on_count += line_on_range.total
 
     return on_count
 
@@ -156,77 +164,402 @@ def sum_on_range(on_range: list[tuple[int, int]]) -> int:
     return sum([r[1]-r[0]+1 for r in on_range])
 
 
-def apply_instruction_to_z_range(on_range: list[tuple[int, int]], instruction: Instruction) -> None: # mutates on_range
-    if len(on_range) == 0:
+def interval_insert(intervals: list[tuple[int, int]], lo: int, hi: int) -> int: # mutates intervals, returns added length
+    # intervals are sorted, disjoint and non-adjacent inclusive (min, max) pairs;
+    # everything overlapping or touching [lo, hi] is a contiguous run that gets replaced by one merged interval
+    i = bisect_left(intervals, (lo,))
+    start = i-1 if i > 0 and intervals[i-1][1] >= lo-1 else i
+    end = bisect_right(intervals, (hi+1, inf))
+
+    merged = intervals[start:end]
+    if merged:
+        lo = min(lo, merged[0][0])
+        hi = max(hi, merged[-1][1])
+    intervals[start:end] = [(lo, hi)]
+
+    return (hi-lo+1) - sum_on_range(merged)
+
+
+def interval_remove(intervals: list[tuple[int, int]], lo: int, hi: int) -> int: # mutates intervals, returns removed length
+    i = bisect_left(intervals, (lo,))
+    start = i-1 if i > 0 and intervals[i-1][1] >= lo else i
+    end = bisect_right(intervals, (hi, inf))
+
+    affected = intervals[start:end]
+    if not affected:
+        return 0
+
+    kept = []
+    if affected[0][0] < lo:
+        kept.append((affected[0][0], lo-1))
+    if affected[-1][1] > hi:
+        kept.append((hi+1, affected[-1][1]))
+    intervals[start:end] = kept
+
+    return sum_on_range(affected) - sum_on_range(kept)
+
+
+class IntervalSet:
+    def __init__(self):
+        self.intervals = [] # [(min, max)], see interval_insert
+        self.total = 0
+
+    def add(self, lo: int, hi: int) -> None:
+        self.total += interval_insert(self.intervals, lo, hi)
+
+    def remove(self, lo: int, hi: int) -> None:
+        self.total -= interval_remove(self.intervals, lo, hi)
+
+    def apply_instruction(self, instruction: Instruction) -> None:
         if instruction.on_or_off == 1:
-            on_range.append((instruction.z_min, instruction.z_max))
+            self.add(instruction.z_min, instruction.z_max)
         else:
-            # not relevant in practice since first instruction is always "on"
-            return
+            self.remove(instruction.z_min, instruction.z_max)
+
+    def __iter__(self):
+        return iter(self.intervals)
+
+    def __len__(self):
+        return len(self.intervals)
+
+
+def apply_instruction_to_z_range(on_range: list[tuple[int, int]], instruction: Instruction) -> None: # mutates on_range
+    if instruction.on_or_off == 1:
+        interval_insert(on_range, instruction.z_min, instruction.z_max)
+    else:
+        interval_remove(on_range, instruction.z_min, instruction.z_max)
+
+
+def compress_axis(ranges: list[tuple[int, int]]) -> list[int]:
+    # each inclusive (min, max) range contributes its half-open boundaries min and max+1,
+    # so elementary interval k spans [edges[k], edges[k+1]) and is either wholly inside or wholly outside every range
+    edges = set()
+    for lo, hi in ranges:
+        edges.add(lo)
+        edges.add(hi+1)
+    return sorted(edges)
+
+
+def lit_length(ranges: list[tuple[int, int, int]]) -> int: # [(min, max, on_or_off)] applied in order
+    if not ranges:
+        return 0
+
+    edges = compress_axis([(lo, hi) for lo, hi, _ in ranges])
+    edge_index = {v: k for k, v in enumerate(edges)}
+
+    cells = bytearray(len(edges)-1)
+    for lo, hi, on_or_off in ranges:
+        lo_idx, hi_idx = edge_index[lo], edge_index[hi+1]
+        cells[lo_idx:hi_idx] = (b"\x01" if on_or_off == 1 else b"\x00") * (hi_idx-lo_idx)
+
+    return sum([edges[k+1]-edges[k] for k in range(len(cells)) if cells[k]])
+
+
+def count_z_column(instructions: list[Instruction]) -> int:
+    # instructions must already be known to cover this (x, y) column, in their original order
+    return lit_length([(i.z_min, i.z_max, i.on_or_off) for i in instructions])
+
+
+def count_x_slab(instructions: list[Instruction], x: int) -> int: # lit area of the yz plane at this x
+    slab_instructions = [i for i in instructions if i.x_min <= x <= i.x_max]
+    if not any(i.on_or_off == 1 for i in slab_instructions):
+        return 0
 
-    z_range = (instruction.z_min, instruction.z_max)
+    y_edges = compress_axis([(i.y_min, i.y_max) for i in slab_instructions])
 
+    area = 0
+    for k in range(len(y_edges)-1):
+        y = y_edges[k]
+        column_instructions = [i for i in slab_instructions if i.y_min <= y <= i.y_max]
+        if not any(i.on_or_off == 1 for i in column_instructions):
+            continue
+        area += (y_edges[k+1]-y) * count_z_column(column_instructions)
+
+    return area
+
+
+def count_after_reboot_compressed(instructions: list[Instruction]) -> int:
+    # every elementary x interval sees the same instructions throughout, so one yz slab stands in for all of it
+    x_edges = compress_axis([(i.x_min, i.x_max) for i in instructions])
+
+    on_count = 0
+    for k in range(len(x_edges)-1):
+        x = x_edges[k]
+        on_count += (x_edges[k+1]-x) * count_x_slab(instructions, x)
+
+    return on_count
+
+
+def count_x_slabs(instructions: list[Instruction], x_intervals: list[tuple[int, int]]) -> int:
+    # x_intervals are half-open [start, end) elementary intervals from compress_axis
+    return sum([(x_end-x) * count_x_slab(instructions, x) for x, x_end in x_intervals])
+
+
+def count_after_reboot_parallel(instructions: list[Instruction], workers: int = None) -> int:
+    # same slabs as count_after_reboot_compressed, handed out round-robin so each worker gets a mix of busy and quiet ones
+    workers = workers or os.cpu_count() or 1
+    x_edges = compress_axis([(i.x_min, i.x_max) for i in instructions])
+    x_intervals = list(zip(x_edges, x_edges[1:]))
+
+    chunks = [x_intervals[n::workers] for n in range(workers)]
+    chunks = [chunk for chunk in chunks if chunk]
+    if not chunks: # no instructions, nothing lit, and no pool to start
+        return 0
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        return sum(executor.map(count_x_slabs, [instructions]*len(chunks), chunks))
+
+
+def count_after_initialize_compressed(instructions: list[Instruction]) -> int:
+    return count_after_reboot_compressed([i for i in instructions if i.is_within_init_region])
+
+
+def count_after_reboot_numpy(instructions: list[Instruction]) -> int:
+    # numpy is only needed for this counter, so it isn't imported at module load
+    import numpy as np
+
+    x_edges = compress_axis([(i.x_min, i.x_max) for i in instructions])
+    y_edges = compress_axis([(i.y_min, i.y_max) for i in instructions])
+    z_edges = compress_axis([(i.z_min, i.z_max) for i in instructions])
+    x_index = {v: k for k, v in enumerate(x_edges)}
+    y_index = {v: k for k, v in enumerate(y_edges)}
+    z_index = {v: k for k, v in enumerate(z_edges)}
+
+    # each instruction as compressed index ranges, so a slab only needs dict lookups once per instruction
+    boxes = [
+        (
+            x_index[inst.x_min], x_index[inst.x_max+1],
+            y_index[inst.y_min], y_index[inst.y_max+1],
+            z_index[inst.z_min], z_index[inst.z_max+1],
+            inst.on_or_off == 1,
+        )
+        for inst in instructions
+    ]
+
+    y_widths = np.diff(np.array(y_edges, dtype=np.int64))
+    z_widths = np.diff(np.array(z_edges, dtype=np.int64))
+
+    # sweep the x slabs with one 2D yz plane of one byte per compressed cell, reset and replayed for every slab,
+    # rather than holding the whole compressed volume (that would be about 570MB for the real input)
+    plane = np.zeros((len(y_edges)-1, len(z_edges)-1), dtype=bool)
+    on_count = 0
+    for k in range(len(x_edges)-1):
+        plane[:] = False
+        covered = False
+        for x_lo, x_hi, y_lo, y_hi, z_lo, z_hi, is_on in boxes:
+            if x_lo <= k < x_hi:
+                plane[y_lo:y_hi, z_lo:z_hi] = is_on
+                covered = covered or is_on
+        if covered:
+            on_count += (x_edges[k+1]-x_edges[k]) * int(y_widths @ (plane @ z_widths))
+    return on_count
+
+
+def count_after_initialize_numpy(instructions: list[Instruction]) -> int:
+    return count_after_reboot_numpy([i for i in instructions if i.is_within_init_region])
+
+
+def cuboid_volume(c: Cuboid) -> int:
+    return (c.x_max-c.x_min+1) * (c.y_max-c.y_min+1) * (c.z_max-c.z_min+1)
+
+
+def cuboid_intersection(a: Cuboid, b: Cuboid) -> Cuboid: # or None if they don't touch
+    x_min, x_max = max(a.x_min, b.x_min), min(a.x_max, b.x_max)
+    y_min, y_max = max(a.y_min, b.y_min), min(a.y_max, b.y_max)
+    z_min, z_max = max(a.z_min, b.z_min), min(a.z_max, b.z_max)
+    if x_min > x_max or y_min > y_max or z_min > z_max:
+        return None
+    return Cuboid(x_min, x_max, y_min, y_max, z_min, z_max)
+
+
+def apply_instruction_signed(signed_cuboids: dict, instruction: Instruction) -> int: # mutates signed_cuboids {Cuboid: weight}, returns change in on count
+    # cancel out whatever is already counted inside the new cuboid, then count the cuboid itself if it's "on"
+    # identical cuboids share one entry, and entries whose weights cancel to 0 are dropped
+    cuboid = instruction.cuboid
+    updates = Counter()
+    for other, weight in signed_cuboids.items():
+        overlap = cuboid_intersection(cuboid, other)
+        if overlap is not None:
+            updates[overlap] -= weight
     if instruction.on_or_off == 1:
-        overlapped_any_subrange = False
-        for i in range(len(on_range)):
-            subrange = on_range[i]
-            if z_range[0] <= subrange[0] and z_range[1] >= subrange[1]:
-                # input range is at least as large -> replace current
-                on_range[i] = z_range
-                overlapped_any_subrange = True
-            elif z_range[0] >= subrange[0] and z_range[1] <= subrange[1]:
-                # lies entirely within -> do nothing & stop checking
-                return
-            elif subrange[0] <= z_range[0] <= subrange[1] or subrange[0] <= z_range[1] <= subrange[1]:
-                # one end lies within -> extend
-                on_range[i] = (min(subrange[0], z_range[0]), max(subrange[1], z_range[1]))
-                overlapped_any_subrange = True
-
-        if not overlapped_any_subrange:
-            on_range.append(z_range)
-
-    else: # off
-        subranges_to_remove = []
-        for i in range(len(on_range)):
-            subrange = on_range[i]
-            if z_range[1] < subrange[0] or z_range[0] > subrange[1]:
-                # no overlap -> do nothing
-                pass
-            elif z_range[0] <= subrange[0] and z_range[1] >= subrange[1]:
-                # input range is at least as large -> delete
-                subranges_to_remove.append(i)
-            elif z_range[0] > subrange[0] and z_range[1] < subrange[1]:
-                # lies entirely within -> split
-                subranges_to_remove.append(i)
-                on_range.append((subrange[0], z_range[0]-1))
-                on_range.append((z_range[1]+1, subrange[1]))
-            elif z_range[0] <= subrange[0] and subrange[0] < z_range[1] < subrange[1]:
-                # input overlaps left endpoint of this range -> shrink
-                on_range[i] = (z_range[1]+1, subrange[1])
-            elif subrange[0] < z_range[0] < subrange[1] and z_range[1] >= subrange[1]:
-                # input overlaps right endpoint of this range -> shrink
-                on_range[i] = (subrange[0], z_range[0]-1)
-            else:
-                raise Exception("unhandled scenario in OFF case!")
-
-        shift = 0
-        for i in subranges_to_remove:
-            on_range.pop(i-shift)
-            shift += 1
-
-    on_range.sort()
-
-    # reduce by consolidating overlapping ranges
-    should_continue = True
-    while(should_continue):
-        should_continue = False
-        for i in range(0, len(on_range)-1):
-            this_one, next_one = on_range[i], on_range[i+1]
-            if this_one[1] >= next_one[0]:
-                on_range[i+1] = (this_one[0], next_one[1])
-                on_range.pop(0)
-                should_continue = True
-                break
+        updates[cuboid] += 1
+
+    delta = 0
+    for c, weight in updates.items():
+        if weight == 0:
+            continue
+        new_weight = signed_cuboids.get(c, 0) + weight
+        if new_weight == 0:
+            del signed_cuboids[c]
+        else:
+            signed_cuboids[c] = new_weight
+        delta += weight * cuboid_volume(c)
+
+    return delta
+
+
+def reboot_signed(instructions: list[Instruction]) -> (int, list[int]): # (on count, signed cuboid count after each step)
+    signed_cuboids = {}
+    on_count = 0
+    cuboid_counts = []
+    for inst in instructions:
+        on_count += apply_instruction_signed(signed_cuboids, inst)
+        cuboid_counts.append(len(signed_cuboids))
+    return on_count, cuboid_counts
+
+
+def on_counts_after_each_step(instructions) -> Iterator[int]:
+    # instructions can be any iterable, they are consumed one at a time and only the signed cuboids are kept
+    signed_cuboids = {}
+    on_count = 0
+    for inst in instructions:
+        on_count += apply_instruction_signed(signed_cuboids, inst)
+        yield on_count
+
+
+def count_after_reboot_signed(instructions: list[Instruction]) -> int:
+    on_count, _ = reboot_signed(instructions)
+    return on_count
+
+
+def cuboid_difference(a: Cuboid, b: Cuboid) -> list[Cuboid]: # disjoint pieces of a that lie outside b
+    overlap = cuboid_intersection(a, b)
+    if overlap is None:
+        return [a]
+
+    # peel off slabs along x, then y within the overlap's x range, then z within the overlap's x and y ranges
+    pieces = []
+    if a.x_min < overlap.x_min:
+        pieces.append(Cuboid(a.x_min, overlap.x_min-1, a.y_min, a.y_max, a.z_min, a.z_max))
+    if overlap.x_max < a.x_max:
+        pieces.append(Cuboid(overlap.x_max+1, a.x_max, a.y_min, a.y_max, a.z_min, a.z_max))
+    if a.y_min < overlap.y_min:
+        pieces.append(Cuboid(overlap.x_min, overlap.x_max, a.y_min, overlap.y_min-1, a.z_min, a.z_max))
+    if overlap.y_max < a.y_max:
+        pieces.append(Cuboid(overlap.x_min, overlap.x_max, overlap.y_max+1, a.y_max, a.z_min, a.z_max))
+    if a.z_min < overlap.z_min:
+        pieces.append(Cuboid(overlap.x_min, overlap.x_max, overlap.y_min, overlap.y_max, a.z_min, overlap.z_min-1))
+    if overlap.z_max < a.z_max:
+        pieces.append(Cuboid(overlap.x_min, overlap.x_max, overlap.y_min, overlap.y_max, overlap.z_max+1, a.z_max))
+    return pieces
+
+
+def lit_cuboids(instructions: list[Instruction]) -> list[Cuboid]: # disjoint cuboids covering exactly the cubes left on
+    cuboids = []
+    for inst in instructions:
+        cuboid = inst.cuboid
+        remaining = []
+        for existing in cuboids:
+            remaining.extend(cuboid_difference(existing, cuboid))
+        if inst.on_or_off == 1:
+            remaining.append(cuboid)
+        cuboids = remaining
+    return cuboids
+
+
+def cuboid_bounds(cuboids: list[Cuboid]) -> Cuboid:
+    return Cuboid(
+        min([c.x_min for c in cuboids]), max([c.x_max for c in cuboids]),
+        min([c.y_min for c in cuboids]), max([c.y_max for c in cuboids]),
+        min([c.z_min for c in cuboids]), max([c.z_max for c in cuboids]),
+    )
+
+
+def cuboid_contains_point(c: Cuboid, point: Point3) -> bool:
+    return c.x_min <= point.x <= c.x_max and c.y_min <= point.y <= c.y_max and c.z_min <= point.z <= c.z_max
+
+
+def cuboid_contains_cuboid(outer: Cuboid, inner: Cuboid) -> bool:
+    return (outer.x_min <= inner.x_min and inner.x_max <= outer.x_max
+        and outer.y_min <= inner.y_min and inner.y_max <= outer.y_max
+        and outer.z_min <= inner.z_min and inner.z_max <= outer.z_max)
+
+
+@dataclass
+class CuboidIndexNode:
+    bounds: Cuboid
+    volume: int
+    cuboids: list[Cuboid] # only populated on leaves
+    children: list["CuboidIndexNode"]
+
+
+class CuboidIndex:
+    # k-d tree over disjoint lit cuboids, each node knows its bounding box and the lit volume beneath it
+    LEAF_SIZE = 8
+
+    def __init__(self, cuboids: list[Cuboid]):
+        self.cuboids = list(cuboids)
+        self.root = self._build(self.cuboids) if self.cuboids else None
+        self.volume = self.root.volume if self.root else 0
+
+    @classmethod
+    def from_instructions(cls, instructions: list[Instruction]):
+        return cls(lit_cuboids(instructions))
+
+    def _build(self, cuboids: list[Cuboid]) -> CuboidIndexNode:
+        bounds = cuboid_bounds(cuboids)
+        if len(cuboids) <= self.LEAF_SIZE:
+            return CuboidIndexNode(bounds, sum([cuboid_volume(c) for c in cuboids]), cuboids, [])
+
+        # split on the widest axis at the median cuboid midpoint
+        axis = max(range(3), key=lambda a: bounds[2*a+1] - bounds[2*a])
+        ordered = sorted(cuboids, key=lambda c: c[2*axis] + c[2*axis+1])
+        middle = len(ordered) // 2
+        children = [self._build(ordered[:middle]), self._build(ordered[middle:])]
+        return CuboidIndexNode(bounds, sum([child.volume for child in children]), [], children)
+
+    def is_on(self, point: Point3) -> bool:
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            if not cuboid_contains_point(node.bounds, point):
+                continue
+            if any(cuboid_contains_point(c, point) for c in node.cuboids):
+                return True
+            stack.extend(node.children)
+        return False
+
+    def count_in_region(self, region: Cuboid) -> int:
+        on_count = 0
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            if cuboid_intersection(node.bounds, region) is None:
+                continue
+            if cuboid_contains_cuboid(region, node.bounds):
+                on_count += node.volume
+                continue
+            for c in node.cuboids:
+                overlap = cuboid_intersection(c, region)
+                if overlap is not None:
+                    on_count += cuboid_volume(overlap)
+            stack.extend(node.children)
+        return on_count
+
+    def dumps(self) -> str:
+        # same format as the puzzle input, so a saved state is just a list of "on" instructions
+        return "\n".join([
+            f"on x={c.x_min}..{c.x_max},y={c.y_min}..{c.y_max},z={c.z_min}..{c.z_max}" for c in self.cuboids
+        ])
+
+    @classmethod
+    def loads(cls, input_string: str):
+        cuboids = []
+        for inst in instructions_from_lines(input_string.split("\n")):
+            if inst.on_or_off != 1:
+                raise ValueError(f"saved state can only hold lit cuboids, got an off line for {inst.cuboid}")
+            cuboids.append(inst.cuboid)
+        return cls(cuboids)
+
+
+REBOOT_COUNTERS = {
+    "compressed": count_after_reboot_compressed,
+    "signed": count_after_reboot_signed,
+    "parallel": count_after_reboot_parallel,
+    "numpy": count_after_reboot_numpy,
+    "planar": count_after_reboot_planar,
+    "linear": count_after_reboot_linear,
+    "ranges": count_after_reboot_with_ranges,
+}
 
 
 if __name__ == "__main__":
@@ -241,8 +574,20 @@ if __name__ == "__main__":
 
 
     print("Part 2")
-    on_after_reboot = count_after_reboot_linear(instructions)
-    print(f"(p2 answer) cubes on after reboot = {on_after_reboot}") #
+    # the grid-walking counters are kept for comparison, e.g. `python puzzle22.py linear`, but only "compressed" finishes on the real input
+    # `--workers N` runs the "parallel" counter on N processes, N=0 or no N means one per CPU
+    counter_name = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else None
+    if "--workers" in sys.argv:
+        following = sys.argv[sys.argv.index("--workers")+1:]
+        if following and not following[0].startswith("--") and not following[0].isdigit():
+            sys.exit(f"usage: {sys.argv[0]} [parallel] --workers N, got --workers {following[0]}")
+        workers = int(following[0]) if following and following[0].isdigit() else 0
+        if counter_name not in (None, "parallel"):
+            sys.exit(f"--workers only applies to the parallel counter, not {counter_name}")
+        on_after_reboot = count_after_reboot_parallel(instructions, workers)
+    else:
+        on_after_reboot = REBOOT_COUNTERS[counter_name or "compressed"](instructions)
+    print(f"(p2 answer) cubes on after reboot = {on_after_reboot}") # 1197308251666843
 
 
 ###############################################################################
@@ -366,6 +711,12 @@ def test_initialize_grid_large_sample():
     assert 590784 == sum(grid.values())
 
 
+def test_count_xy_area():
+    instructions = instructions_from_input(SAMPLE_INPUT_SMALL)
+    assert count_xy_area(instructions[:2]) == 14
+    assert count_xy_area(instructions) == 11
+
+
 def test_count_after_initialize_planar_small_sample():
     instructions = instructions_from_input(SAMPLE_INPUT_SMALL)
     on_count = count_after_initialize_planar(instructions)
@@ -384,10 +735,10 @@ def test_count_after_initialize_planar_p2_sample():
     assert 474140 == on_count
 
 
-#def test_count_after_reboot_planar_p2_sample():
-#    instructions = instructions_from_input(SAMPLE_INPUT_P2)
-#    on_count = count_after_reboot_planar(instructions)
-#    assert 2758514936282235 == on_count
+def test_count_after_reboot_planar_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    on_count = count_after_reboot_planar(instructions)
+    assert 2758514936282235 == on_count
 
 #def test_count_after_reboot_linear_p2_sample():
 #    instructions = instructions_from_input(SAMPLE_INPUT_P2)
@@ -515,7 +866,167 @@ def test_apply_instruction_to_z_range_p2_sample():
     assert on_range == [(-44,38)]
 
 
+def test_interval_set():
+    intervals = IntervalSet()
+    intervals.add(10, 12)
+    intervals.add(20, 22)
+    assert list(intervals) == [(10,12), (20,22)]
+    assert intervals.total == 6
+
+    intervals.add(13, 19) # touches both neighbours
+    assert list(intervals) == [(10,22)]
+    assert intervals.total == 13
+
+    intervals.remove(15, 16)
+    assert list(intervals) == [(10,14), (17,22)]
+    assert intervals.total == 11
+
+    intervals.remove(0, 11)
+    intervals.remove(22, 30)
+    assert list(intervals) == [(12,14), (17,21)]
+    assert intervals.total == 8
+
+    intervals.remove(40, 50)
+    assert intervals.total == 8
+
+
 def test_count_after_reboot_with_ranges_p2_sample():
     instructions = instructions_from_input(SAMPLE_INPUT_P2)
     on_count = count_after_reboot_with_ranges(instructions)
     assert 2758514936282235 == on_count
+
+
+def test_compress_axis():
+    assert compress_axis([(10, 12), (11, 13), (9, 11), (10, 10)]) == [9, 10, 11, 12, 13, 14]
+    assert compress_axis([(-5, 5)]) == [-5, 6]
+
+
+def test_count_after_reboot_compressed_small_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_SMALL)
+    on_count = count_after_reboot_compressed(instructions)
+    assert 39 == on_count
+
+
+def test_count_after_initialize_compressed_large_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_LARGE)
+    on_count = count_after_initialize_compressed(instructions)
+    assert 590784 == on_count
+
+
+def test_count_after_reboot_compressed_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    on_count = count_after_reboot_compressed(instructions)
+    assert 2758514936282235 == on_count
+
+
+def test_count_after_reboot_parallel_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    on_count = count_after_reboot_parallel(instructions, workers=3)
+    assert 2758514936282235 == on_count
+
+
+def test_count_after_initialize_numpy_large_sample():
+    import pytest
+    pytest.importorskip("numpy")
+    instructions = instructions_from_input(SAMPLE_INPUT_LARGE)
+    on_count = count_after_initialize_numpy(instructions)
+    assert 590784 == on_count
+
+
+def test_count_after_reboot_numpy_p2_sample():
+    import pytest
+    pytest.importorskip("numpy")
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    on_count = count_after_reboot_numpy(instructions)
+    assert 2758514936282235 == on_count
+
+
+def test_cuboid_intersection():
+    a = Cuboid(10, 12, 10, 12, 10, 12)
+    assert cuboid_intersection(a, Cuboid(11, 13, 11, 13, 11, 13)) == Cuboid(11, 12, 11, 12, 11, 12)
+    assert cuboid_intersection(a, Cuboid(13, 14, 10, 12, 10, 12)) is None
+    assert cuboid_volume(a) == 27
+
+
+def test_reboot_signed_small_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_SMALL)
+    on_count, cuboid_counts = reboot_signed(instructions)
+    assert 39 == on_count
+    assert len(cuboid_counts) == 4
+    assert cuboid_counts[:2] == [1, 3]
+
+
+def test_count_after_reboot_signed_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    on_count = count_after_reboot_signed(instructions)
+    assert 2758514936282235 == on_count
+
+
+def test_instructions_from_lines_small_sample():
+    lines = ["on x=10..12,y=10..12,z=10..12\n", "\n", "off x=9..11,y=9..11,z=9..11\n"]
+    expected = [
+        Instruction(1, 10, 12, 10, 12, 10, 12, True),
+        Instruction(0, 9, 11, 9, 11, 9, 11, True),
+    ]
+    computed = list(instructions_from_lines(lines))
+    assert expected == computed
+
+
+def test_on_counts_after_each_step_small_sample():
+    instructions = instructions_from_lines(SAMPLE_INPUT_SMALL.split("\n"))
+    computed = list(on_counts_after_each_step(instructions))
+    assert computed == [27, 46, 38, 39]
+
+
+def test_on_counts_after_each_step_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    computed = list(on_counts_after_each_step(instructions))
+    assert len(computed) == len(instructions)
+    assert computed[-1] == 2758514936282235
+    assert computed[9] == count_after_reboot_compressed(instructions[:10])
+
+
+def test_cuboid_difference():
+    a = Cuboid(10, 12, 10, 12, 10, 12)
+    pieces = cuboid_difference(a, Cuboid(11, 11, 11, 11, 11, 11)) # punch out the middle
+    assert len(pieces) == 6
+    assert sum([cuboid_volume(c) for c in pieces]) == 26
+    assert cuboid_difference(a, Cuboid(20, 21, 10, 12, 10, 12)) == [a]
+    assert cuboid_difference(a, Cuboid(0, 20, 0, 20, 0, 20)) == []
+
+
+def test_cuboid_index_small_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_SMALL)
+    index = CuboidIndex.from_instructions(instructions)
+    grid = initialize_grid(instructions)
+
+    assert index.volume == 39
+    for x in range(8, 15):
+        for y in range(8, 15):
+            for z in range(8, 15):
+                assert index.is_on(Point3(x, y, z)) == (grid.get(Point3(x, y, z), 0) == 1)
+
+    assert index.count_in_region(Cuboid(10, 10, 10, 10, 10, 10)) == 1
+    assert index.count_in_region(Cuboid(9, 11, 9, 11, 9, 11)) == 1
+    assert index.count_in_region(Cuboid(-100, 100, -100, 100, -100, 100)) == 39
+
+
+def test_cuboid_index_p2_sample():
+    instructions = instructions_from_input(SAMPLE_INPUT_P2)
+    index = CuboidIndex.from_instructions(instructions)
+    assert index.volume == 2758514936282235
+    assert index.count_in_region(Cuboid(-50, 50, -50, 50, -50, 50)) == 474140
+
+    reloaded = CuboidIndex.loads(index.dumps())
+    assert reloaded.volume == 2758514936282235
+    assert reloaded.count_in_region(Cuboid(-50, 50, -50, 50, -50, 50)) == 474140
+    assert reloaded.is_on(Point3(0, 0, 0)) == index.is_on(Point3(0, 0, 0))
+
+
+def test_count_after_reboot_parallel_no_instructions():
+    assert count_after_reboot_parallel([], workers=2) == count_after_reboot_compressed([]) == 0
+
+def test_cuboid_index_loads_rejects_off_lines():
+    import pytest
+    with pytest.raises(ValueError):
+        CuboidIndex.loads("on x=10..12,y=10..12,z=10..12\noff x=9..11,y=9..11,z=9..11")